@@ -19,348 +19,40 @@ drive.mount('/content/drive', force_remount=True)
 ! pip install rouge_score
 
 import gc
-import re
-import nltk
+import os
 import torch
-import unicodedata
-import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 
 from tqdm.contrib import tzip
 from tqdm.notebook import tqdm
-from datasets import load_metric
 from IPython.display import display, HTML
 from sklearn.model_selection import train_test_split
-from transformers import PegasusForConditionalGeneration, PegasusTokenizer, Trainer, TrainingArguments
-
-nltk.download('punkt')
-nltk.download('stopwords')
-from nltk.corpus import stopwords
-
-rouge_metric = load_metric('rouge')
-
-class PegasusDataset(torch.utils.data.Dataset):
-  def __init__(self, encodings, labels):
-    self.encodings = encodings
-    self.labels = labels
-  def __getitem__(self, idx):
-    item = {key: torch.tensor(val[idx]) for key, val in self.encodings.items()}
-    item['labels'] = torch.tensor(self.labels['input_ids'][idx])  # torch.tensor(self.labels[idx])
-    return item
-  def __len__(self):
-    return len(self.labels['input_ids'])  # len(self.labels)
-
-def compute_metrics(pred_str, label_str):
-    # labels_ids = pred.label_ids
-    # pred_ids = pred.predictions
-
-    # # all unnecessary tokens are removed
-    # pred_str = tokenizer.batch_decode(pred_ids, skip_special_tokens=True)
-    # labels_ids[labels_ids == -100] = tokenizer.pad_token_id
-    # label_str = tokenizer.batch_decode(labels_ids, skip_special_tokens=True)
-
-    rouge_output1 = rouge_metric.compute(predictions=pred_str, references=label_str, rouge_types=["rouge1"])["rouge1"].mid
-    rouge_output2 = rouge_metric.compute(predictions=pred_str, references=label_str, rouge_types=["rouge2"])["rouge2"].mid
-    rouge_outputL = rouge_metric.compute(predictions=pred_str, references=label_str, rouge_types=["rougeL"])["rougeL"].mid
-
-    return {
-        "rouge1_precision": round(rouge_output1.precision, 4),
-        "rouge1_recall": round(rouge_output1.recall, 4),
-        "rouge1_fmeasure": round(rouge_output1.fmeasure, 4),
-        "rouge2_precision": round(rouge_output2.precision, 4),
-        "rouge2_recall": round(rouge_output2.recall, 4),
-        "rouge2_fmeasure": round(rouge_output2.fmeasure, 4),
-        "rougeL_precision": round(rouge_outputL.precision, 4),
-        "rougeL_recall": round(rouge_outputL.recall, 4),
-        "rougeL_fmeasure": round(rouge_outputL.fmeasure, 4),
-    }
-
-def compute_metrics_from_text(decoded_preds, decoded_labels):
-  # Rouge expects a newline after each sentence
-  decoded_preds = ["\n".join(nltk.sent_tokenize(pred.strip())) for pred in decoded_preds]
-  decoded_labels = ["\n".join(nltk.sent_tokenize(label.strip())) for label in decoded_labels]
-
-  result = rouge_metric.compute(predictions=decoded_preds, references=decoded_labels, use_stemmer=True)
-  # Extract a few results
-  result = {key: value.mid.fmeasure * 100 for key, value in result.items()}
-
-  encoded_preds = tokenizer.encode(decoded_preds, skip_special_tokens=True)
-  # Add mean generated length
-  prediction_lens = [np.count_nonzero(pred != tokenizer.pad_token_id) for pred in encoded_preds]
-  result["gen_len"] = np.mean(prediction_lens)
-
-  return {k: round(v, 4) for k, v in result.items()}
-
-def compute_metrics_from_tokens(eval_pred):
-  predictions, labels = eval_pred
-  decoded_preds = tokenizer.batch_decode(predictions, skip_special_tokens=True)
-  # Replace -100 in the labels as we can't decode them.
-  labels = np.where(labels != -100, labels, tokenizer.pad_token_id)
-  decoded_labels = tokenizer.batch_decode(labels, skip_special_tokens=True)
-
-  # Rouge expects a newline after each sentence
-  decoded_preds = ["\n".join(nltk.sent_tokenize(pred.strip())) for pred in decoded_preds]
-  decoded_labels = ["\n".join(nltk.sent_tokenize(label.strip())) for label in decoded_labels]
-
-  result = rouge_metric.compute(predictions=decoded_preds, references=decoded_labels, use_stemmer=True)
-  # Extract a few results
-  result = {key: value.mid.fmeasure * 100 for key, value in result.items()}
-
-  # Add mean generated length
-  prediction_lens = [np.count_nonzero(pred != tokenizer.pad_token_id) for pred in predictions]
-  result["gen_len"] = np.mean(prediction_lens)
-
-  return {k: round(v, 4) for k, v in result.items()}
-
-def prepare_data(model_name,
-                 train_texts, train_labels,
-                 val_texts=None, val_labels=None,
-                 test_texts=None, test_labels=None,
-                 tokenizer = None,):
-  """
-  Prepare input data for model fine-tuning
-  """
-  tokenizer = PegasusTokenizer.from_pretrained(model_name)
-
-  prepare_val = False if val_texts is None or val_labels is None else True
-  prepare_test = False if test_texts is None or test_labels is None else True
-
-  def tokenize_data(texts, labels):
-    encodings = tokenizer(texts, truncation=True, padding=True)
-    decodings = tokenizer(labels, truncation=True, padding=True)
-    dataset_tokenized = PegasusDataset(encodings, decodings)
-    return dataset_tokenized
-
-  train_dataset = tokenize_data(train_texts, train_labels)
-  val_dataset = tokenize_data(val_texts, val_labels) if prepare_val else None
-  test_dataset = tokenize_data(test_texts, test_labels) if prepare_test else None
-
-  return train_dataset, val_dataset, test_dataset, tokenizer
-
-def prepare_fine_tuning(model_name, tokenizer, train_dataset, model = None, val_dataset=None, freeze_encoder=False, num_epochs = 1, output_dir='./results'):
-  """
-  Prepare configurations and base model for fine-tuning
-  """
-  torch_device = 'cuda' if torch.cuda.is_available() else 'cpu'
-  if model == None:
-    model = PegasusForConditionalGeneration.from_pretrained(model_name).to(torch_device)
-  else:
-    model = model.to(torch_device)
-
-  if freeze_encoder:
-    for param in model.model.encoder.parameters():
-      param.requires_grad = False
-
-  if val_dataset is not None:
-    training_args = TrainingArguments(
-      output_dir=output_dir,           # output directory
-      # num_train_epochs=2000,           # total number of training epochs
-      num_train_epochs=num_epochs,           # total number of training epochs
-      # per_device_train_batch_size=1,   # batch size per device during training, can increase if memory allows
-      per_device_train_batch_size=10,   # batch size per device during training, can increase if memory allows
-      # per_device_eval_batch_size=1,    # batch size for evaluation, can increase if memory allows
-      per_device_eval_batch_size=1,    # batch size for evaluation, can increase if memory allows
-      save_steps=250,                  # number of updates steps before checkpoint saves
-      save_total_limit=5,              # limit the total amount of checkpoints and deletes the older checkpoints
-      evaluation_strategy='steps',     # evaluation strategy to adopt during training
-      eval_steps=50,                  # number of update steps before evaluation
-      warmup_steps=50,                # number of warmup steps for learning rate scheduler
-      weight_decay=0.01,               # strength of weight decay
-      logging_dir='./logs',            # directory for storing logs
-      logging_steps=50,
-    )
-
-    trainer = Trainer(
-      model=model,                         # the instantiated 🤗 Transformers model to be trained
-      args=training_args,                  # training arguments, defined above
-      train_dataset=train_dataset,         # training dataset
-      eval_dataset=val_dataset,            # evaluation dataset
-      # data_collator=data_collator,
-      tokenizer=tokenizer,
-      compute_metrics=compute_metrics_from_tokens
-    )
-
-  else:
-    training_args = TrainingArguments(
-      output_dir=output_dir,           # output directory
-      # num_train_epochs=2000,           # total number of training epochs
-      num_train_epochs=num_epochs,           # total number of training epochs
-      # per_device_train_batch_size=1,   # batch size per device during training, can increase if memory allows
-      per_device_train_batch_size=1,   # batch size per device during training, can increase if memory allows
-      save_steps=250,                  # number of updates steps before checkpoint saves
-      save_total_limit=5,              # limit the total amount of checkpoints and deletes the older checkpoints
-      warmup_steps=50,                # number of warmup steps for learning rate scheduler
-      weight_decay=0.01,               # strength of weight decay
-      logging_dir='./logs',            # directory for storing logs
-      logging_steps=50,
-    )
-
-    trainer = Trainer(
-      model=model,                         # the instantiated 🤗 Transformers model to be trained
-      args=training_args,                  # training arguments, defined above
-      train_dataset=train_dataset,         # training dataset
-      # data_collator=data_collator,
-      tokenizer=tokenizer,
-      compute_metrics=compute_metrics_from_tokens
-    )
-
-  return trainer
-
-# replacing many abbreviations and lower casing the words
-def process_words(sentence):
-  sentence = str(sentence).lower()
-  sentence = unicodedata.normalize('NFKD', sentence).encode('ascii', 'ignore').decode('utf-8', 'ignore') # for converting é to e and other accented chars
-  sentence = re.sub(r"http\S+","",sentence)
-  sentence = re.sub(r"there's", "there is", sentence)
-  sentence = re.sub(r"i'm", "i am", sentence)
-  sentence = re.sub(r"he's", "he is", sentence)
-  sentence = re.sub(r"she's", "she is", sentence)
-  sentence = re.sub(r"it's", "it is", sentence)
-  sentence = re.sub(r"that's", "that is", sentence)
-  sentence = re.sub(r"what's", "that is", sentence)
-  sentence = re.sub(r"where's", "where is", sentence)
-  sentence = re.sub(r"how's", "how is", sentence)
-  sentence = re.sub(r"\'ll", " will", sentence)
-  sentence = re.sub(r"\'ve", " have", sentence)
-  sentence = re.sub(r"\'re", " are", sentence)
-  sentence = re.sub(r"\'d", " would", sentence)
-  sentence = re.sub(r"\'re", " are", sentence)
-  sentence = re.sub(r"won't", "will not", sentence)
-  sentence = re.sub(r"can't", "can not", sentence)
-  sentence = re.sub(r"n't", " not", sentence)
-  sentence = re.sub(r"n'", "ng", sentence)
-  sentence = re.sub(r"'bout", "about", sentence)
-  sentence = re.sub(r"'til", "until", sentence)
-  sentence = re.sub(r"\$", " usd ", sentence)
-  sentence = re.sub(r"৳", " usd ", sentence)
-  sentence = re.sub(r"₹", " inr ", sentence)
-  sentence = re.sub(r"%", " percent", sentence)
-  sentence = re.sub(r" & ", " and ", sentence)
-  sentence = re.sub(r" &amp ", " and ", sentence)
-  sentence = re.sub(r"&amp", "\&", sentence)
-  sentence = re.sub(r",", "", sentence)
-  sentence = re.sub(r"\"", "", sentence)
-  sentence = re.sub(r"\'", "", sentence)
-  sentence = re.sub(r' s ', "",sentence)
-  sentence = re.sub(r"&#39", "", sentence) # the inshorts data has this in it
-  sentence = re.sub(r"&39", "", sentence) # the inshorts data has this in it
-  sentence = re.sub(r"&#34", "", sentence) # the inshorts data has this in it
-  sentence = re.sub(r"&34", "", sentence) # the inshorts data has this in it
-  sentence = re.sub(r"\\n", "", sentence)
-  sentence = sentence.strip()
-  return sentence
-
-# remove unnecessary characters and transforming colloquial word to its common form
-def clean_sentences(text):
-  emoj = re.compile("["
-    u"\U0001F600-\U0001F64F"    # emoticons
-    u"\U0001F300-\U0001F5FF"    # symbols & pictographs
-    u"\U0001F680-\U0001F6FF"    # transport & map symbols
-    u"\U0001F1E0-\U0001F1FF"    # flags (iOS)
-    u"\U00002500-\U00002BEF"    # chinese char
-    u"\U00002702-\U000027B0"
-    u"\U00002702-\U000027B0"
-    u"\U000024C2-\U0001F251"
-    u"\U0001f926-\U0001f937"
-    u"\U00010000-\U0010ffff"
-    u"\u2640-\u2642"
-    u"\u2600-\u2B55"
-    u"\u200d"
-    u"\u23cf"
-    u"\u23e9"
-    u"\u231a"
-    u"\ufe0f"
-    u"\u3030"
-    "]+", re.UNICODE)
-
-  text = text.lower()                                                             # make lowercase letters
-  text = re.sub(emoj, '', text)                                                   # remove emoji
-  text = re.sub(r'(.)\1{2,}', r'\1', text)                                        # change the repeated letters above 2 times to just 1
-  text = re.sub("[\-_;:]", " ", text)                                            # remove -, _ and :
-  text = re.sub("[¹²³¹⁰ⁱ⁴⁵⁶⁷⁸⁹⁺⁻⁼⁽⁾ⁿ]", "", text)                                 # remove power character
-  text = re.sub(r"From|\S*@\S*\s?|Subject", "", text)                             # remove email starts
-  text = re.sub("[^\w\s]*[_.!?#&;:><+-/)/(\'\"]", " ", text)                     # remove not string and whitespace
-  text = re.sub("\s+", " ", text)                                                 # remove extra spaces
-  text = re.sub(" +", " ", text.strip())                                          # Remove unnecessary white space
-  return text
-
-# list_stopwords = set(stopwords.words('english'))
-# list_stopwords.remove('no')
-# list_stopwords.remove('not')
-# list_stopwords
-
-# Eliminate stopwords and suffixes
-def remove_stopwords(text):
-  list_stopwords = set(stopwords.words('english'))                            # stopword from nltk
-  list_stopwords.remove('no')                                                 # remove 'no' and 'no' from list_stopwords
-  list_stopwords.remove('not')
-  text = " ".join(w if w not in list_stopwords else '' for w in text.split())
-  text = re.sub(" +", " ", text.strip())                                      # Remove unnecessary white space
-  return text
-
-def clean_text(text):
-  text = process_words(text)
-  text = clean_sentences(text)
-  text = remove_stopwords(text)
-  text = text.strip()
-  return text
-
-def clean_df(df, col_name):
-  df[col_name] = df[col_name].apply(process_words)
-  df[col_name] = df[col_name].apply(clean_sentences)
-  df[col_name] = df[col_name].apply(remove_stopwords)
-  df[col_name] = df[col_name].apply(lambda x: x.strip())
-
-  return df
-
-df_news_raw = pd.read_excel('https://github.com/ruhan-islam/text-summarizer/blob/main/dataset/news_data.xlsx?raw=true')
-
-# display(HTML(df_news_raw.sample(3).to_html()))
-
-df_news_raw.iloc[:, 0] = df_news_raw.iloc[:, 0].str.replace('&#34;', '\'')
-df_news_raw.iloc[:, 0] = df_news_raw.iloc[:, 0].str.replace('&#39;', '\'')
-df_news_raw.iloc[:, 0] = df_news_raw.iloc[:, 0].str.replace('&amp;', '&')
-
-df_news_raw.iloc[:, 1] = df_news_raw.iloc[:, 1].str.replace('&#34;', '\'')
-df_news_raw.iloc[:, 1] = df_news_raw.iloc[:, 1].str.replace('&#39;', '\'')
-df_news_raw.iloc[:, 1] = df_news_raw.iloc[:, 1].str.replace('&amp;', '&')
-
-# df_news.drop(['Source ', 'Time ', 'Publish Date'], axis=1, inplace=True)
-df_news = df_news_raw[['short', 'long']]
-
-# display(HTML(df_news.sample(3).to_html()))
-
-# df_news = clean_df(df_news, 'long')
 
-# data_idx = 45885
-# print(df_news.iloc[data_idx]['short'])
-# print(df_news.iloc[data_idx]['long'])
-
-# data_idx = 24443
-# print(df_news.iloc[data_idx]['short'])
-# print(df_news.iloc[data_idx]['long'])
-
-# data_idx = 45885
-# print(df_news_raw.iloc[data_idx]['short'])
-# print(df_news_raw.iloc[data_idx]['long'])
-
-# display(HTML(df_news.sample(3).to_html()))
+from text_summarizer import (NEWS_DATA_URL, ExtractiveSelector, SummaryCache, clean_texts_parallel, compute_metrics,
+                             compute_metrics_from_text, dedup_splits, ensure_snapshot, evaluate, evaluate_cli,
+                             get_summary, get_summary_variants, load_cpu_model, load_model, prepare_data,
+                             prepare_fine_tuning, snapshot_split, summarize_batch, summarize_file, summarize_long)
 
-df_news = df_news.dropna()
-df_news.info()
+# decoded text, word and token counts are written once to a memory-mapped snapshot on drive
+snapshot_path = '/content/drive/MyDrive/ML_project/news_data.arrow'
+news_snapshot = ensure_snapshot(NEWS_DATA_URL, snapshot_path)
+# python -m text_summarizer.snapshot news_data.arrow --source news_data.xlsx
 
-print(df_news.shape)
-# df_news.head()
+# from text_summarizer.benchmarks import benchmark_process_words, benchmark_text_cleaner
+# benchmark_process_words(news_snapshot['long'][:5000].to_pylist())
+# benchmark_text_cleaner(news_snapshot['long'].to_pandas().sample(2000, random_state=0))
 
-# display(HTML(df_news.sample(3).to_html()))
+# data_idx = 45885
+# print(news_snapshot['short'][data_idx])
+# print(news_snapshot['long'][data_idx])
 
-for col in df_news.columns.tolist():
-    df_news[col+"_num_words"] = df_news[col].apply(lambda x: len(x.split()))
-df_news.head()
+print(news_snapshot.num_rows, news_snapshot.column_names)
 
-cols = ['short_num_words','long_num_words']
-df_news[cols].describe()
+# only the count columns are materialized for the plots
+cols = ['short_num_words','long_num_words','short_num_tokens','long_num_tokens']
+df_news = news_snapshot.select(cols).to_pandas()
+df_news.describe()
 
 df_news["short_num_words"].hist(bins=10, figsize=(8,6))
 
@@ -370,13 +62,17 @@ df_news["long_num_words"].hist(bins=10, figsize=(8,6))
 (val_start,val_size) = (20000,15000)
 (test_start,test_size) = (10000,10000)
 
-train_end = train_start + train_size
-val_end = val_start + val_size
-test_end = test_start + test_size
+train_texts, train_labels = snapshot_split(news_snapshot, train_start, train_size)
+val_texts, val_labels = snapshot_split(news_snapshot, val_start, val_size)
+test_texts, test_labels = snapshot_split(news_snapshot, test_start, test_size)
 
-train_texts, train_labels = list(df_news['long'][train_start:train_end]), list(df_news['short'][train_start:train_end])
-val_texts, val_labels = list(df_news['long'][val_start:val_end]), list(df_news['short'][val_start:val_end])
-test_texts, test_labels = list(df_news['long'][test_start:test_end]), list(df_news['short'][test_start:test_end])
+# train_texts = clean_texts_parallel(train_texts, num_workers=os.cpu_count())
+
+# reposted stories are dropped from train and val when they also appear in test
+# splits = dedup_splits({'test': (test_texts, test_labels), 'val': (val_texts, val_labels), 'train': (train_texts, train_labels)},
+#                       threshold=0.8, num_workers=os.cpu_count())
+# (test_texts, test_labels), (val_texts, val_labels), (train_texts, train_labels) = splits['test'], splits['val'], splits['train']
+# print({name: len(split_texts) for name, (split_texts, _) in splits.items()})
 
 torch.cuda.empty_cache()
 gc.collect()
@@ -388,18 +84,25 @@ pretrain_dir = '/content/drive/MyDrive/ML_project/pretrained_2'
 
 # train_dataset, val_dataset, test_dataset, tokenizer = prepare_data(model_name, train_texts, train_labels, val_texts, val_labels, test_texts, test_labels)
 # # trainer = prepare_fine_tuning(model_name, tokenizer, train_dataset, val_dataset, output_dir=pretrain_dir)
+# validation on 500 stratified val articles with batched greedy generation, evaluated on each saved checkpoint in a separate process
+# # trainer = prepare_fine_tuning(model_name, tokenizer, train_dataset, val_dataset=val_dataset, output_dir=pretrain_dir,
+# #                               eval_subset_size=500, eval_batch_size=16, async_eval=True, eval_generate_kwargs={'num_beams': 1})
 # trainer = prepare_fine_tuning(model_name, tokenizer, train_dataset, output_dir=pretrain_dir)
 
-# torch_device = 'cuda' if torch.cuda.is_available() else 'cpu'
-# tokenizer = PegasusTokenizer.from_pretrained(pretrain_dir)
-# model = PegasusForConditionalGeneration.from_pretrained(pretrain_dir).to(torch_device)
+# tokenizer, model = load_model(pretrain_dir)
 
-torch_device = 'cuda' if torch.cuda.is_available() else 'cpu'
-tokenizer = PegasusTokenizer.from_pretrained(model_name)
-model = PegasusForConditionalGeneration.from_pretrained(model_name).to(torch_device)
+tokenizer, model = load_model(model_name)
 
 # train_dataset, val_dataset, test_dataset, tokenizer = prepare_data(model_name, train_texts, train_labels, val_texts, val_labels, test_texts, test_labels, tokenizer=tokenizer)
+# train_dataset, val_dataset, test_dataset, tokenizer = prepare_data(model_name, train_texts, train_labels, val_texts, val_labels, test_texts, test_labels, tokenizer=tokenizer, cache_dir='/content/drive/MyDrive/ML_project/token_cache')
 # trainer = prepare_fine_tuning(model_name, tokenizer, train_dataset, model=model, output_dir=pretrain_dir)
+# cpu nodes: the memory preset picks gradient checkpointing, accumulation to 16 samples, frozen layers and bf16
+# trainer = prepare_fine_tuning(model_name, tokenizer, train_dataset, model=model, output_dir=pretrain_dir, memory_budget_gb=16)
+# from text_summarizer.benchmarks import benchmark_training_presets
+# benchmark_training_presets(model_name, tokenizer, train_texts[:200], train_labels[:200], steps=5)
+
+# from text_summarizer.benchmarks import benchmark_padding
+# benchmark_padding(model, tokenizer, train_texts[:400], train_labels[:400])
 
 torch.cuda.empty_cache()
 gc.collect()
@@ -419,25 +122,73 @@ gc.collect()
 
 # trainer.save_model(pretrain_dir)
 
-# torch_device = 'cuda' if torch.cuda.is_available() else 'cpu'
-
 # tokenizer = trainer.tokenizer
-# model = trainer.model.to(torch_device)
-
-# tokenizer = PegasusTokenizer.from_pretrained(pretrain_dir)
-# model = PegasusForConditionalGeneration.from_pretrained(pretrain_dir).to(torch_device)
-
-def get_summary(text):
-  torch_device = 'cuda' if torch.cuda.is_available() else 'cpu'
-  tokens = tokenizer(text, truncation=True, padding="longest", return_tensors="pt").to(torch_device)
-  summary = model.generate(**tokens)
-  pred_summary = tokenizer.decode(summary[0])
-  return pred_summary
+# model = trainer.model
+
+# tokenizer, model = load_model(pretrain_dir)
+
+
+# articles past the 512 token input are summarized per sentence window and then summarized again
+# pred_summary = summarize_long(text, model=model, tokenizer=tokenizer, window_tokens=512, overlap_tokens=64)
+
+# only the top ranked sentences, up to 256 tokens, are passed to Pegasus
+# selector = ExtractiveSelector(tokenizer, token_budget=256, method='textrank')
+# pred_summary = get_summary(text, model=model, tokenizer=tokenizer, selector=selector)
+# from text_summarizer.benchmarks import benchmark_extractive
+# benchmark_extractive(model, tokenizer, test_texts[:500], test_labels[:500], token_budget=256, batch_size=16)
+
+# cpu serving: int8 Linear layers, quantized once and reloaded from drive afterwards
+# cpu_tokenizer, cpu_model = load_cpu_model(pretrain_dir, quantized_dir='/content/drive/MyDrive/ML_project/quantized', intra_op_threads=os.cpu_count())
+# from text_summarizer.benchmarks import benchmark_quantization
+# benchmark_quantization(model, tokenizer, test_texts[:200], test_labels[:200], batch_size=8, quantized_model=cpu_model)
+
+# cpu serving on ONNX Runtime: graphs exported once, then loaded from local files only
+# from text_summarizer.onnx_backend import export_onnx, load_onnx_model, onnx_parity
+# export_onnx(model, tokenizer, '/content/drive/MyDrive/ML_project/onnx')
+# onnx_tokenizer, onnx_model = load_onnx_model('/content/drive/MyDrive/ML_project/onnx', intra_op_threads=os.cpu_count())
+# onnx_parity(model, onnx_model, tokenizer, test_texts[:100], batch_size=8)
+# pred_summary = get_summary(text, model=onnx_model, tokenizer=onnx_tokenizer)
+
+# greedy summaries with a distilled Pegasus drafting tokens for the main model to verify, identical to plain greedy ones
+# from text_summarizer.assisted import get_summary_assisted, load_draft_model
+# draft_model = load_draft_model('sshleifer/distill-pegasus-xsum-16-4', model=model)
+# pred_summary = get_summary_assisted(text, draft_model, model=model, tokenizer=tokenizer)
+# from text_summarizer.benchmarks import benchmark_assisted
+# benchmark_assisted(model, tokenizer, draft_model, test_texts[:100])
+
+# a headline and a blurb from one encoder pass over the article
+# summary_variants = get_summary_variants(text, {'headline': {'max_length': 16}, 'blurb': {'max_length': 64, 'num_beams': 8}},
+#                                         model=model, tokenizer=tokenizer)
+
+# concurrent requests are micro-batched into one generate call, e.g. behind an async web handler
+# from text_summarizer.service import SummarizationService
+# service = SummarizationService(model, tokenizer, max_batch_size=8, max_latency=0.02, timeout=30)
+# pred_summary = await service.summarize(text)
+# python -m text_summarizer.service news_data.xlsx --model /content/drive/MyDrive/ML_project/pretrained --concurrency 16 --max-batch-size 8
+
+# summary_cache = SummaryCache(cache_dir='/content/drive/MyDrive/ML_project/summary_cache', ttl=7 * 24 * 3600,
+#                              near_duplicate_threshold=0.9)
+# pred_summary = get_summary(text, model=model, tokenizer=tokenizer, cache=summary_cache)
+# from text_summarizer.benchmarks import benchmark_summary_cache
+# benchmark_summary_cache(model, tokenizer, test_texts[:100] * 2, batch_size=16)
+
+# per-stage timings (clean, tokenize, pad, generate, decode, score) with token and batch size counts
+# from text_summarizer import stage_metrics
+# stage_metrics.enable()
+# print(stage_metrics.to_prometheus())
+# stage_metrics.to_json('stage_timings.json')
+# with stage_metrics.profile('generate_trace.json', mode='torch'):
+#   get_summary(text, model=model, tokenizer=tokenizer)
+
+# test_preds = summarize_batch(test_texts[:1000], batch_size=16, model=model, tokenizer=tokenizer)
+# report = evaluate(model, tokenizer, test_texts[:1000], test_labels[:1000], batch_size=16, output_path='test_scores.parquet')
+# evaluate_cli([snapshot_path, '--model', pretrain_dir, '--start', str(test_start), '--size', '1000'])
+# summarize_file('news_data.xlsx', 'news_summaries.jsonl', keep_columns=('short',), batch_size=16, model=model, tokenizer=tokenizer)
 
 # metrics = []
 # for text,label in tzip(test_texts[:1000],test_labels[:1000]):
 #   # print(type(label))
-#   metrics.append(compute_metrics([get_summary(text)],[label]))
+#   metrics.append(compute_metrics([get_summary(text, model=model, tokenizer=tokenizer)],[label]))
 
 # data_len = len(metrics)
 
@@ -459,9 +210,9 @@ def get_summary(text):
 
 idx = 54321
 
-text = df_news_raw['long'][idx]
-ref_summary = df_news_raw['short'][idx]
-pred_summary = get_summary(text)
+text = news_snapshot['long'][idx].as_py()
+ref_summary = news_snapshot['short'][idx].as_py()
+pred_summary = get_summary(text, model=model, tokenizer=tokenizer)
 
 print(text)
 print(ref_summary)
@@ -477,20 +228,20 @@ compute_metrics(preds, refs)
 
 # idx = 31212
 
-# text = df_news_raw['long'][idx]
-# ref_summary = df_news_raw['short'][idx]
-# pred_summary = get_summary(text)
+# text = news_snapshot['long'][idx].as_py()
+# ref_summary = news_snapshot['short'][idx].as_py()
+# pred_summary = get_summary(text, model=model, tokenizer=tokenizer)
 
 # print(text)
 # print(ref_summary)
 # print(pred_summary)
 
-# compute_metrics_from_text(decoded_preds=preds, decoded_labels=refs)
+# compute_metrics_from_text(decoded_preds=preds, decoded_labels=refs, tokenizer=tokenizer)
 
 # text = '''
 # According to the Guinness World Records, the most generations alive in a single family have been seven.  The difference between the oldest and the youngest person in the family was about 109 years, when Augusta Bunge&#39;s great-great-great-great grandson was born on January 21, 1989. The family belonged to the United States of America.
 # '''
-# get_summary(text)
+# get_summary(text, model=model, tokenizer=tokenizer)
 
 def plot_run_info(run_data):
   run_data = run_data.replace('\n',' ')
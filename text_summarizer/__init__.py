@@ -0,0 +1,43 @@
+"""
+Text summarization with Pegasus
+
+Submodules load on first attribute access, so `import text_summarizer` does not pull in torch,
+transformers or NLTK data until a function that needs them is used.
+"""
+import importlib
+
+_exports = {
+  'assisted': ['DRAFT_MODEL_NAME', 'get_summary_assisted', 'load_draft_model', 'summarize_assisted'],
+  'cleaning': ['TextCleaner', 'TextNormalizer', 'clean_df', 'clean_sentences', 'clean_text', 'clean_texts_parallel',
+               'get_text_cleaner', 'get_text_normalizer', 'process_words', 'remove_stopwords'],
+  'data': ['PegasusDataCollator', 'PegasusDataset', 'TokenCache', 'batched', 'prefetch', 'prepare_data', 'read_articles'],
+  'dedup': ['MinHasher', 'NearDuplicateIndex', 'dedup_splits', 'near_duplicate_clusters'],
+  'encoder_cache': ['EncoderCache', 'get_summary_variants', 'summarize_variants'],
+  'evaluation': ['evaluate', 'evaluate_cli'],
+  'extractive': ['ExtractiveSelector'],
+  'inference': ['get_summary', 'iter_summary_batches', 'summarize_batch', 'summarize_file'],
+  'instrumentation': ['Instrumentation', 'stage_metrics'],
+  'long_document': ['sentence_windows', 'summarize_long', 'summarize_long_batch'],
+  'metrics': ['ROUGE_KEYS', 'RougeScorer', 'compute_metrics', 'compute_metrics_from_text', 'compute_metrics_from_tokens'],
+  'onnx_backend': ['OnnxSummarizer', 'export_onnx', 'load_onnx_model', 'onnx_parity'],
+  'quantization': ['configure_threads', 'load_cpu_model', 'load_quantized', 'quantize_model', 'save_quantized'],
+  'resources': ['DEFAULT_MODEL_NAME', 'english_stopwords', 'load_model', 'resolve_model', 'torch_device'],
+  'service': ['SummarizationService', 'load_test'],
+  'snapshot': ['NEWS_DATA_URL', 'build_snapshot', 'ensure_snapshot', 'load_snapshot', 'snapshot_split'],
+  'summary_cache': ['SummaryCache', 'model_id'],
+  'training_eval': ['EvalSubset', 'SubsetEvalCallback', 'evaluate_subset', 'stratified_indices'],
+  'training': ['PegasusTrainer', 'TRAINING_PRESETS', 'estimate_training_memory_gb', 'prepare_fine_tuning', 'select_preset'],
+}
+_submodule_of = {name: module for module, names in _exports.items() for name in names}
+
+__all__ = sorted(_submodule_of)
+
+def __getattr__(name):
+  if name not in _submodule_of:
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+  value = getattr(importlib.import_module(f'.{_submodule_of[name]}', __name__), name)
+  globals()[name] = value
+  return value
+
+def __dir__():
+  return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,49 @@
+"""
+Assisted (speculative) greedy decoding: a small draft Pegasus proposes tokens the main model verifies in one forward pass
+"""
+from .inference import summarize_batch
+from .resources import load_model, resolve_model
+
+DRAFT_MODEL_NAME = 'sshleifer/distill-pegasus-xsum-16-4'
+
+def check_draft_model(model, draft_model):
+  """
+  Raise ValueError unless the draft proposes tokens from the same vocabulary with the same special tokens as model
+  """
+  for name in ('vocab_size', 'pad_token_id', 'eos_token_id', 'decoder_start_token_id'):
+    if getattr(model.config, name) != getattr(draft_model.config, name):
+      raise ValueError(f"draft model {name} {getattr(draft_model.config, name)} does not match {getattr(model.config, name)}")
+
+def load_draft_model(draft_name=DRAFT_MODEL_NAME, model=None, num_assistant_tokens=5, schedule='heuristic'):
+  """
+  Draft model from a hub name or a fine-tuned directory, checked against model and moved to its device;
+  the heuristic schedule grows or shrinks the number of proposed tokens with how many were accepted
+  """
+  _, draft_model = load_model(draft_name)
+  if model is not None:
+    check_draft_model(model, draft_model)
+    draft_model = draft_model.to(model.device)
+  draft_model.generation_config.num_assistant_tokens = num_assistant_tokens
+  draft_model.generation_config.num_assistant_tokens_schedule = schedule
+  return draft_model.eval()
+
+def assisted_kwargs(draft_model, **generate_kwargs):
+  """
+  generate kwargs for assisted decoding, which transformers supports for greedy search only
+  """
+  if generate_kwargs.get('num_beams', 1) != 1 or generate_kwargs.get('do_sample'):
+    raise ValueError("assisted decoding needs greedy search, num_beams=1 without sampling")
+  # pegasus-xsum defaults to beam search in its generation config, so greedy is set explicitly
+  return {**generate_kwargs, 'num_beams': 1, 'assistant_model': draft_model}
+
+def summarize_assisted(texts, draft_model, model=None, tokenizer=None, cache=None, selector=None, **generate_kwargs):
+  """
+  Greedy summaries identical to the main model's, generated one text at a time as assisted decoding requires
+  """
+  model, tokenizer = resolve_model(model, tokenizer)
+  return summarize_batch(texts, batch_size=1, model=model, tokenizer=tokenizer, cache=cache, selector=selector,
+                         **assisted_kwargs(draft_model, **generate_kwargs))
+
+def get_summary_assisted(text, draft_model, model=None, tokenizer=None, cache=None, selector=None, **generate_kwargs):
+  return summarize_assisted([text], draft_model, model=model, tokenizer=tokenizer, cache=cache, selector=selector,
+                            **generate_kwargs)[0]
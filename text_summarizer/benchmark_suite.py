@@ -0,0 +1,318 @@
+"""
+Reproducible offline benchmark suite, runnable as python -m text_summarizer.benchmark_suite,
+saving JSON results that --compare checks against a previous run
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from .cleaning import clean_sentences, process_words, remove_stopwords
+from .data import prepare_data
+
+SUITE_VERSION = 1
+
+SYNTHETIC_WORDS = ("government minister said would new year people police country city report market company week "
+                   "million percent court election team game season players club health hospital school students "
+                   "water climate energy prices workers union strike bank rates economy trade talks deal").split()
+SYNTHETIC_EXTRAS = ["don't", "it's", "won't", "R&D", "AT&T", "12.5%", "$3.2bn", "😀", "reporter@news.com", "sooooo",
+                    "(Reuters)", "U.S.", "re-elected", "“quoted”"]
+
+def synthetic_articles(num_articles=200, seed=0, article_words=(120, 400), summary_words=(8, 20)):
+  """
+  Fixed pseudo-random news-like (texts, labels) with the contractions, symbols and emojis the cleaning stages handle
+  """
+  rng = random.Random(seed)
+  texts, labels = [], []
+  for _ in range(num_articles):
+    words = []
+    for _ in range(rng.randint(*article_words)):
+      words.append(rng.choice(SYNTHETIC_EXTRAS) if rng.random() < 0.04 else rng.choice(SYNTHETIC_WORDS))
+      if rng.random() < 0.07:
+        words[-1] += "."
+    texts.append(" ".join(words).capitalize() + ".")
+    labels.append(" ".join(rng.choice(SYNTHETIC_WORDS) for _ in range(rng.randint(*summary_words))).capitalize())
+  return texts, labels
+
+def tiny_model(texts, seed=0, d_model=64, layers=2, max_input_tokens=512):
+  """
+  Offline (tokenizer, model) pair: a word-level tokenizer fit on texts and a randomly initialized Pegasus of the
+  given size, so generation and training steps run the real code paths without downloading a checkpoint
+  """
+  import torch
+  from tokenizers import Tokenizer, models, pre_tokenizers, processors, trainers
+  from transformers import PegasusConfig, PegasusForConditionalGeneration, PreTrainedTokenizerFast
+
+  word_level = Tokenizer(models.WordLevel(unk_token='<unk>'))
+  word_level.pre_tokenizer = pre_tokenizers.Whitespace()
+  word_level.train_from_iterator(texts, trainers.WordLevelTrainer(special_tokens=['<pad>', '</s>', '<unk>']))
+  word_level.post_processor = processors.TemplateProcessing(single="$A </s>", special_tokens=[('</s>', 1)])
+  tokenizer = PreTrainedTokenizerFast(tokenizer_object=word_level, pad_token='<pad>', eos_token='</s>', unk_token='<unk>',
+                                      model_max_length=max_input_tokens)
+
+  torch.manual_seed(seed)
+  config = PegasusConfig(vocab_size=len(tokenizer), d_model=d_model, encoder_layers=layers, decoder_layers=layers,
+                         encoder_attention_heads=4, decoder_attention_heads=4, encoder_ffn_dim=4 * d_model,
+                         decoder_ffn_dim=4 * d_model, max_position_embeddings=max_input_tokens, pad_token_id=0,
+                         eos_token_id=1, decoder_start_token_id=0, forced_eos_token_id=1)
+  return tokenizer, PegasusForConditionalGeneration(config).eval()
+
+class PeakRss:
+  """
+  Peak resident set size in MB while the block runs, sampled from /proc, else the process lifetime peak
+  """
+  def __init__(self, interval=0.005):
+    self.interval = interval
+    self.peak_mb = 0.0
+    self.stop = threading.Event()
+    self.sampler = None
+
+  @staticmethod
+  def current_mb():
+    with open('/proc/self/statm') as f:
+      return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+
+  def sample(self):
+    while not self.stop.is_set():
+      self.peak_mb = max(self.peak_mb, self.current_mb())
+      self.stop.wait(self.interval)
+
+  def __enter__(self):
+    if os.path.exists('/proc/self/statm'):
+      self.sampler = threading.Thread(target=self.sample, daemon=True)
+      self.sampler.start()
+    return self
+
+  def __exit__(self, *exc_info):
+    if self.sampler is not None:
+      self.stop.set()
+      self.sampler.join()
+      self.peak_mb = max(self.peak_mb, self.current_mb())
+    else:
+      self.peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10   # kilobytes on linux
+    self.peak_mb = round(self.peak_mb, 1)
+
+def best_seconds(func, repeat):
+  timings = []
+  for _ in range(repeat):
+    start = time.perf_counter()
+    func()
+    timings.append(time.perf_counter() - start)
+  return min(timings)
+
+def bench_cleaning(texts, repeat=3):
+  """
+  Documents per second of each cleaning stage, fed the output of the stage before it as in clean_text
+  """
+  inputs = {'process_words': texts}
+  inputs['clean_sentences'] = [process_words(text) for text in texts]
+  inputs['remove_stopwords'] = [clean_sentences(text) for text in inputs['clean_sentences']]
+  results = {}
+  for func in (process_words, clean_sentences, remove_stopwords):
+    stage_inputs = inputs[func.__name__]
+    seconds = best_seconds(lambda: [func(text) for text in stage_inputs], repeat)
+    results[func.__name__] = {'docs_per_sec': round(len(texts) / seconds, 1)}
+  return results
+
+def bench_prepare_data(tokenizer, texts, labels, repeat=3):
+  """
+  Article and summary tokens per second through prepare_data
+  """
+  train_dataset = prepare_data(None, texts, labels, tokenizer=tokenizer)[0]
+  num_tokens = sum(len(item['input_ids']) + len(item['labels']) for item in train_dataset)
+  seconds = best_seconds(lambda: prepare_data(None, texts, labels, tokenizer=tokenizer), repeat)
+  return {'tokens_per_sec': round(num_tokens / seconds, 1), 'num_tokens': num_tokens}
+
+def bench_get_summary(model, tokenizer, texts, warmup=2, **generate_kwargs):
+  """
+  Latency percentiles of get_summary, one article at a time
+  """
+  from .inference import get_summary
+
+  for text in texts[:warmup]:
+    get_summary(text, model=model, tokenizer=tokenizer, **generate_kwargs)
+  latencies = []
+  for text in texts:
+    start = time.perf_counter()
+    get_summary(text, model=model, tokenizer=tokenizer, **generate_kwargs)
+    latencies.append(time.perf_counter() - start)
+  return {f'latency_p{q}': round(float(np.percentile(latencies, q)), 5) for q in (50, 95)}
+
+def bench_train_step(model, tokenizer, texts, labels, steps=10, warmup=2, **fine_tuning_kwargs):
+  """
+  Optimizer steps per second and peak RSS of the Trainer prepare_fine_tuning builds, warmup steps excluded,
+  with fine_tuning_kwargs such as a memory preset passed on to prepare_fine_tuning
+  """
+  import torch
+  from transformers import TrainerCallback
+
+  from .training import prepare_fine_tuning
+
+  class StepTimer(TrainerCallback):
+    def __init__(self):
+      self.durations = []
+
+    def on_step_begin(self, args, state, control, **kwargs):
+      self.start = time.perf_counter()
+
+    def on_step_end(self, args, state, control, **kwargs):
+      self.durations.append(time.perf_counter() - self.start)
+
+  train_dataset = prepare_data(None, texts, labels, tokenizer=tokenizer)[0]
+  with tempfile.TemporaryDirectory() as output_dir:
+    trainer = prepare_fine_tuning(None, tokenizer, train_dataset, model=model, output_dir=output_dir, **fine_tuning_kwargs)
+    # only the step count and side effects change: no checkpoints, logging integrations or warmup schedule;
+    # the arguments are edited in place, a replaced TrainingArguments would reset the trainer's accelerator state
+    trainer.args.max_steps = warmup + steps
+    trainer.args.save_strategy = 'no'
+    trainer.args.warmup_steps = 0
+    for callback in list(trainer.callback_handler.callbacks):
+      if type(callback).__module__.startswith('transformers.integrations'):
+        trainer.remove_callback(callback)
+    timer = StepTimer()
+    trainer.add_callback(timer)
+    with PeakRss() as rss:
+      trainer.train()
+  durations = timer.durations[warmup:]
+  batch_size = trainer.args.per_device_train_batch_size * trainer.args.gradient_accumulation_steps
+  results = {
+    'steps_per_sec': round(len(durations) / sum(durations), 3),
+    'samples_per_sec': round(len(durations) * batch_size / sum(durations), 3),
+    'peak_rss_mb': rss.peak_mb,
+  }
+  if torch.cuda.is_available():
+    results['peak_cuda_mb'] = round(torch.cuda.max_memory_allocated() / 2 ** 20, 1)
+  return results
+
+def environment():
+  import torch
+  import transformers
+
+  try:
+    commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    commit = None
+  return {'suite_version': SUITE_VERSION, 'commit': commit, 'python': platform.python_version(), 'torch': torch.__version__,
+          'transformers': transformers.__version__, 'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+          'torch_threads': torch.get_num_threads()}
+
+def check_offline_data(skip=()):
+  """
+  Raise before anything runs when the NLTK stopwords the cleaning benchmark needs are not cached, the suite never downloads
+  """
+  if 'cleaning' in skip:
+    return
+  import nltk
+  try:
+    nltk.data.find('corpora/stopwords')
+  except LookupError:
+    raise RuntimeError("the cleaning benchmark needs the NLTK stopwords: run python -m nltk.downloader stopwords "
+                       "once while online, or pass --skip cleaning") from None
+
+def run_suite(model_dir=None, num_articles=200, seed=0, repeat=3, latency_texts=20, train_steps=10, threads=None,
+              skip=(), output_path=None):
+  """
+  Run every benchmark on the fixed synthetic sample with the tiny model, or the model in model_dir, and save the JSON results
+  """
+  import torch
+
+  check_offline_data(skip)
+  if threads:
+    torch.set_num_threads(threads)
+  torch.manual_seed(seed)
+  texts, labels = synthetic_articles(num_articles, seed)
+  if model_dir is not None:
+    from .resources import load_model
+    tokenizer, model = load_model(model_dir)
+  else:
+    tokenizer, model = tiny_model(texts, seed)
+
+  results = {'environment': environment(), 'settings': {'model': model_dir or 'tiny', 'num_articles': num_articles, 'seed': seed,
+                                                        'repeat': repeat, 'latency_texts': latency_texts, 'train_steps': train_steps}}
+  if 'cleaning' not in skip:
+    results['cleaning'] = bench_cleaning(texts, repeat)
+  if 'prepare_data' not in skip:
+    results['prepare_data'] = bench_prepare_data(tokenizer, texts, labels, repeat)
+  if 'get_summary' not in skip:
+    results['get_summary'] = bench_get_summary(model, tokenizer, texts[:latency_texts], num_beams=1, max_length=32)
+  # training changes the weights, so it runs last
+  if 'train_step' not in skip:
+    results['train_step'] = bench_train_step(model, tokenizer, texts, labels, steps=train_steps)
+
+  if output_path is not None:
+    with open(output_path, 'w') as f:
+      json.dump(results, f, indent=2)
+  return results
+
+def flatten(results, prefix=''):
+  flat = {}
+  for key, value in results.items():
+    if key in ('environment', 'settings'):
+      continue
+    if isinstance(value, dict):
+      flat.update(flatten(value, f'{prefix}{key}.'))
+    else:
+      flat[f'{prefix}{key}'] = value
+  return flat
+
+def compare(baseline, current, tolerance=0.1):
+  """
+  Metrics of current worse than baseline by more than tolerance: lower throughput, or higher latency and memory
+  """
+  if baseline.get('settings') != current.get('settings'):
+    print(f"warning: settings differ, {baseline.get('settings')} vs {current.get('settings')}")
+  baseline, current = flatten(baseline), flatten(current)
+  regressions = {}
+  for name, value in current.items():
+    if name not in baseline or not baseline[name]:
+      continue
+    change = value / baseline[name] - 1
+    higher_is_better = name.endswith('_per_sec')
+    lower_is_better = name.rsplit('.', 1)[-1].startswith('latency_') or name.endswith('_mb')
+    print(f"{name}: {baseline[name]} -> {value} ({change:+.1%})")
+    if (higher_is_better and change < -tolerance) or (lower_is_better and change > tolerance):
+      regressions[name] = {'baseline': baseline[name], 'current': value, 'change': round(change, 4)}
+  return regressions
+
+def benchmark_suite_cli(argv=None):
+  parser = argparse.ArgumentParser(description="Offline benchmarks for cleaning, tokenization, training steps and generation")
+  parser.add_argument('--output', default='benchmark_results.json', help="JSON file for the results")
+  parser.add_argument('--compare', default=None, help="earlier results JSON, exits with status 1 on regressions")
+  parser.add_argument('--tolerance', type=float, default=0.1, help="relative change counted as a regression")
+  parser.add_argument('--model', default=None, help="local model directory instead of the tiny random model")
+  parser.add_argument('--articles', type=int, default=200)
+  parser.add_argument('--seed', type=int, default=0)
+  parser.add_argument('--repeat', type=int, default=3)
+  parser.add_argument('--latency-texts', type=int, default=20)
+  parser.add_argument('--train-steps', type=int, default=10)
+  parser.add_argument('--threads', type=int, default=None, help="torch intra-op threads, fix it for comparable runs")
+  parser.add_argument('--skip', nargs='*', default=(), choices=('cleaning', 'prepare_data', 'get_summary', 'train_step'))
+  args = parser.parse_args(argv)
+  try:
+    check_offline_data(args.skip)
+  except RuntimeError as e:
+    parser.error(str(e))
+
+  results = run_suite(args.model, args.articles, args.seed, args.repeat, args.latency_texts, args.train_steps, args.threads,
+                      args.skip, args.output)
+  print(json.dumps(results, indent=2))
+  if args.compare is not None:
+    with open(args.compare) as f:
+      regressions = compare(json.load(f), results, args.tolerance)
+    if regressions:
+      print(f"regressions: {json.dumps(regressions, indent=2)}")
+      sys.exit(1)
+  return results
+
+if __name__ == '__main__':
+  benchmark_suite_cli()
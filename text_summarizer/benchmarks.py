@@ -0,0 +1,287 @@
+"""
+Benchmarks, runnable as python -m text_summarizer.benchmarks
+"""
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from .cleaning import clean_sentences, get_text_cleaner, process_words, process_words_legacy, remove_stopwords
+from .data import PegasusDataCollator, PegasusDataset
+from .resources import torch_device
+
+def benchmark_process_words(texts, repeat=3):
+  """
+  Time process_words against process_words_legacy on the same texts and check they agree
+  """
+  texts = [str(text) for text in texts]
+  mismatches = [text for text in texts if process_words(text) != process_words_legacy(text)]
+  assert not mismatches, f"{len(mismatches)} texts differ, first: {mismatches[0]!r}"
+
+  timings = {}
+  for func in (process_words_legacy, process_words):
+    start = time.perf_counter()
+    for _ in range(repeat):
+      for text in texts:
+        func(text)
+    timings[func.__name__] = (time.perf_counter() - start) / repeat
+
+  for name, seconds in timings.items():
+    print(f"{name}: {seconds:.3f}s for {len(texts)} texts ({len(texts) / seconds:,.0f} texts/s)")
+  print(f"speedup: {timings['process_words_legacy'] / timings['process_words']:.2f}x")
+  return timings
+
+def benchmark_text_cleaner(texts, repeat=3):
+  """
+  Time TextCleaner.clean against chaining process_words, clean_sentences and remove_stopwords
+  """
+  texts = [str(text) for text in texts]
+  text_cleaner = get_text_cleaner()
+
+  def clean_with_functions(text):
+    return remove_stopwords(clean_sentences(process_words(text))).strip()
+
+  mismatches = [text for text in texts if text_cleaner.clean(text) != clean_with_functions(text)]
+  assert not mismatches, f"{len(mismatches)} texts differ, first: {mismatches[0]!r}"
+
+  timings = {}
+  for name, func in (('functions', clean_with_functions), ('TextCleaner', text_cleaner.clean)):
+    start = time.perf_counter()
+    for _ in range(repeat):
+      for text in texts:
+        func(text)
+    timings[name] = (time.perf_counter() - start) / repeat
+
+  for name, seconds in timings.items():
+    print(f"{name}: {seconds:.3f}s for {len(texts)} texts ({len(texts) / seconds:,.0f} texts/s)")
+  print(f"speedup: {timings['functions'] / timings['TextCleaner']:.2f}x")
+  return timings
+
+def benchmark_padding(model, tokenizer, texts, labels, batch_size=8, num_batches=10):
+  """
+  Compare padding every row to the longest in the split with per-batch padding over length-grouped batches
+  """
+  import torch
+  from transformers.trainer_pt_utils import LengthGroupedSampler
+
+  device = torch_device()
+  model = model.to(device)
+  model.train()
+
+  static_inputs = tokenizer(texts, truncation=True, padding=True, return_tensors='pt')
+  static_labels = tokenizer(labels, truncation=True, padding=True, return_tensors='pt')['input_ids']
+  static_labels[static_labels == tokenizer.pad_token_id] = -100
+  dynamic = PegasusDataset(tokenizer(texts, truncation=True), tokenizer(labels, truncation=True))
+  collator = PegasusDataCollator(tokenizer)
+
+  def static_batches():
+    for start in range(0, len(texts), batch_size):
+      yield {
+        'input_ids': static_inputs['input_ids'][start:start + batch_size],
+        'attention_mask': static_inputs['attention_mask'][start:start + batch_size],
+        'labels': static_labels[start:start + batch_size],
+      }
+
+  def dynamic_batches():
+    sampler = list(LengthGroupedSampler(batch_size, lengths=dynamic.lengths.tolist(), generator=torch.Generator().manual_seed(0)))
+    for start in range(0, len(sampler), batch_size):
+      yield collator([dynamic[idx] for idx in sampler[start:start + batch_size]])
+
+  results = {}
+  for name, batches in (('static', static_batches), ('dynamic', dynamic_batches)):
+    real_tokens = total_tokens = timed_tokens = 0
+    elapsed = 0.0
+    for step, batch in enumerate(batches()):
+      real = int(batch['attention_mask'].sum()) + int((batch['labels'] != -100).sum())
+      real_tokens += real
+      total_tokens += batch['input_ids'].numel() + batch['labels'].numel()
+      if step < num_batches:
+        batch = {key: value.to(device) for key, value in batch.items()}
+        start = time.perf_counter()
+        model(**batch).loss.backward()
+        elapsed += time.perf_counter() - start
+        model.zero_grad()
+        timed_tokens += real
+    results[name] = {'padding_ratio': 1 - real_tokens / total_tokens, 'tokens_per_sec': timed_tokens / elapsed}
+    print(f"{name}: padding ratio {results[name]['padding_ratio']:.1%}, {results[name]['tokens_per_sec']:,.0f} real tokens/s")
+
+  model.eval()
+  return results
+
+def benchmark_summary_cache(model, tokenizer, texts, batch_size=8, **generate_kwargs):
+  """
+  Time summarizing texts cold and again through a warm SummaryCache
+  """
+  from .inference import summarize_batch
+  from .summary_cache import SummaryCache
+
+  cache = SummaryCache()
+  timings = {}
+  for name in ('cold', 'warm'):
+    start = time.perf_counter()
+    summaries = summarize_batch(texts, batch_size=batch_size, model=model, tokenizer=tokenizer, cache=cache, **generate_kwargs)
+    timings[name] = (time.perf_counter() - start) / len(texts)
+    print(f"{name}: {timings[name] * 1e6:,.1f}us per article")
+  assert summaries == summarize_batch(texts, batch_size=batch_size, model=model, tokenizer=tokenizer, **generate_kwargs)
+  print(cache.stats())
+  return timings
+
+def benchmark_extractive(model, tokenizer, texts, labels, token_budget=128, method='textrank', batch_size=8, **generate_kwargs):
+  """
+  Compare summarizing full articles with summarizing their extractively pre-selected sentences,
+  reporting generation latency, input length and ROUGE for both
+  """
+  from .extractive import ExtractiveSelector
+  from .inference import summarize_batch
+  from .metrics import rouge_scorer
+
+  selector = ExtractiveSelector(tokenizer, token_budget=token_budget, method=method)
+  results = {}
+  for name, stage in (('full', None), ('extractive', selector)):
+    start = time.perf_counter()
+    inputs = stage(texts) if stage is not None else list(texts)
+    select_seconds = time.perf_counter() - start
+    summaries = summarize_batch(inputs, batch_size=batch_size, model=model, tokenizer=tokenizer, **generate_kwargs)
+    seconds = time.perf_counter() - start
+    rouge = rouge_scorer.compute(summaries, labels)
+    results[name] = {
+      'seconds': round(seconds, 3),
+      'select_seconds': round(select_seconds, 3),
+      'mean_input_tokens': round(float(np.mean([len(ids) for ids in tokenizer(inputs, truncation=True)['input_ids']])), 1),
+      **{key: round(rouge[key], 4) for key in ('rouge1_fmeasure', 'rouge2_fmeasure', 'rougeL_fmeasure')},
+    }
+    print(f"{name}: {results[name]}")
+  print(f"latency saved: {1 - results['extractive']['seconds'] / results['full']['seconds']:.1%}, "
+        f"rougeL change: {results['extractive']['rougeL_fmeasure'] - results['full']['rougeL_fmeasure']:+.4f}")
+  return results
+
+def benchmark_quantization(model, tokenizer, texts, labels, batch_size=8, quantized_model=None,
+                           intra_op_threads=None, inter_op_threads=None, **generate_kwargs):
+  """
+  Compare the fp32 model with its dynamically int8-quantized copy on the cpu: latency, throughput, size and ROUGE
+  """
+  from .inference import iter_summary_batches
+  from .metrics import rouge_scorer
+  from .quantization import configure_threads, model_size_bytes, quantize_model
+
+  threads = configure_threads(intra_op_threads, inter_op_threads)
+  model = model.to('cpu').eval()
+  if quantized_model is None:
+    quantized_model = quantize_model(model)
+
+  results = {}
+  for name, candidate in (('fp32', model), ('int8', quantized_model)):
+    summaries = [None] * len(texts)
+    batch_latencies = []
+    start = batch_start = time.perf_counter()
+    for batch_idx, batch_summaries in iter_summary_batches(candidate, tokenizer, texts, batch_size, **generate_kwargs):
+      batch_latencies.append(time.perf_counter() - batch_start)
+      for idx, pred_summary in zip(batch_idx, batch_summaries):
+        summaries[idx] = pred_summary
+      batch_start = time.perf_counter()
+    seconds = time.perf_counter() - start
+    rouge = rouge_scorer.compute(summaries, labels)
+    results[name] = {
+      'articles_per_sec': round(len(texts) / seconds, 3),
+      'batch_latency_p50': round(float(np.percentile(batch_latencies, 50)), 4),
+      'batch_latency_p95': round(float(np.percentile(batch_latencies, 95)), 4),
+      'model_mb': round(model_size_bytes(candidate) / 2 ** 20, 1),
+      **{key: round(rouge[key], 4) for key in ('rouge1_fmeasure', 'rouge2_fmeasure', 'rougeL_fmeasure')},
+    }
+    print(f"{name}: {results[name]}")
+  results['threads'] = threads
+  print(f"speedup: {results['int8']['articles_per_sec'] / results['fp32']['articles_per_sec']:.2f}x, "
+        f"size: {results['int8']['model_mb'] / results['fp32']['model_mb']:.0%} of fp32")
+  return results
+
+def benchmark_encoder_reuse(model, tokenizer, texts, configs, batch_size=8):
+  """
+  Time one summarize_batch per decoding config against summarize_variants encoding each text once for all configs
+  """
+  from .encoder_cache import summarize_variants
+  from .inference import summarize_batch
+
+  timings = {}
+  start = time.perf_counter()
+  separate = {name: summarize_batch(texts, batch_size=batch_size, model=model, tokenizer=tokenizer, **generate_kwargs)
+              for name, generate_kwargs in configs.items()}
+  timings['separate'] = time.perf_counter() - start
+  start = time.perf_counter()
+  shared = summarize_variants(texts, configs, batch_size=batch_size, model=model, tokenizer=tokenizer)
+  timings['shared_encoder'] = time.perf_counter() - start
+  assert all(summaries[name] == separate[name][idx] for idx, summaries in enumerate(shared) for name in configs)
+
+  for name, seconds in timings.items():
+    print(f"{name}: {seconds:.3f}s for {len(texts)} texts x {len(configs)} configs")
+  print(f"speedup: {timings['separate'] / timings['shared_encoder']:.2f}x")
+  return timings
+
+def benchmark_assisted(model, tokenizer, draft_model, texts, **generate_kwargs):
+  """
+  Per-article greedy latency of the main model alone and assisted by draft_model, checking the summaries are identical
+  """
+  from .assisted import assisted_kwargs
+  from .inference import get_summary
+
+  results, summaries = {}, {}
+  for name, kwargs in (('greedy', {**generate_kwargs, 'num_beams': 1}), ('assisted', assisted_kwargs(draft_model, **generate_kwargs))):
+    latencies, summaries[name] = [], []
+    for text in texts:
+      start = time.perf_counter()
+      summaries[name].append(get_summary(text, model=model, tokenizer=tokenizer, **kwargs))
+      latencies.append(time.perf_counter() - start)
+    results[name] = {
+      'latency_p50': round(float(np.percentile(latencies, 50)), 4),
+      'latency_p95': round(float(np.percentile(latencies, 95)), 4),
+      'articles_per_sec': round(len(texts) / sum(latencies), 3),
+    }
+    print(f"{name}: {results[name]}")
+  mismatches = sum(greedy != assisted for greedy, assisted in zip(summaries['greedy'], summaries['assisted']))
+  assert not mismatches, f"{mismatches} assisted summaries differ from greedy ones"
+  print(f"speedup: {results['assisted']['articles_per_sec'] / results['greedy']['articles_per_sec']:.2f}x")
+  return results
+
+def benchmark_training_presets(model, tokenizer, texts, labels, presets=None, steps=5, warmup=1):
+  """
+  Samples per second and peak memory of a few optimizer steps under each training preset, starting every preset
+  from a fresh copy of model, a model name or directory, or a loaded model that is deep-copied
+  """
+  import copy
+
+  import torch
+
+  from .benchmark_suite import bench_train_step
+  from .training import TRAINING_PRESETS, estimate_training_memory_gb
+
+  results = {}
+  for name in presets or TRAINING_PRESETS:
+    if isinstance(model, str):
+      from transformers import PegasusForConditionalGeneration
+      candidate = PegasusForConditionalGeneration.from_pretrained(model)
+    else:
+      candidate = copy.deepcopy(model)
+    if torch.cuda.is_available():
+      torch.cuda.reset_peak_memory_stats()
+    results[name] = {'estimated_gb': round(estimate_training_memory_gb(candidate, TRAINING_PRESETS[name]), 2)}
+    results[name].update(bench_train_step(candidate, tokenizer, texts, labels, steps=steps, warmup=warmup, preset=name))
+    results[name]['trainable_params'] = sum(param.numel() for param in candidate.parameters() if param.requires_grad)
+    print(f"{name}: {results[name]}")
+    del candidate
+  return results
+
+def benchmark_import_time(repeat=5):
+  """
+  Time a cold import of the package in fresh interpreters, which stays cheap while models and NLTK data load lazily
+  """
+  timings = []
+  for _ in range(repeat):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'import text_summarizer'], check=True)
+    timings.append(time.perf_counter() - start)
+  seconds = min(timings)
+  print(f"import text_summarizer: {seconds * 1000:.0f}ms (best of {repeat})")
+  return seconds
+
+if __name__ == '__main__':
+  benchmark_import_time()
@@ -0,0 +1,289 @@
+"""
+Text normalization and cleaning for news articles
+"""
+import functools
+import os
+import re
+import string
+import unicodedata
+
+from concurrent.futures import ProcessPoolExecutor
+
+from .instrumentation import stage_metrics
+from .resources import english_stopwords
+
+# replacement table for process_words, in the order the rules have to be applied
+WORD_REPLACEMENTS = [
+  ("there's", "there is"),
+  ("i'm", "i am"),
+  ("he's", "he is"),
+  ("she's", "she is"),
+  ("it's", "it is"),
+  ("that's", "that is"),
+  ("what's", "that is"),
+  ("where's", "where is"),
+  ("how's", "how is"),
+  ("'ll", " will"),
+  ("'ve", " have"),
+  ("'re", " are"),
+  ("'d", " would"),
+  ("won't", "will not"),
+  ("can't", "can not"),
+  ("n't", " not"),
+  ("n'", "ng"),
+  ("'bout", "about"),
+  ("'til", "until"),
+  ("$", " usd "),
+  ("৳", " usd "),
+  ("₹", " inr "),
+  ("%", " percent"),
+]
+
+# these match on the spaces WORD_REPLACEMENTS inserts, so they run after it
+AMPERSAND_REPLACEMENTS = [
+  (" & ", " and "),
+  (" &amp ", " and "),
+  ("&amp", "\\&"),
+]
+
+PUNCTUATION_DELETIONS = ",\"'"
+
+# only show up once the punctuation above has been dropped
+LEFTOVER_DELETIONS = [" s ", "&#39", "&39", "&#34", "&34", "\\n"]
+
+APOSTROPHE_WORD_CHARS = string.ascii_lowercase + "'"
+
+class TextNormalizer:
+  """
+  process_words with the replacement tables prepared once; the contraction rules only run on the apostrophe
+  words of a sentence, found with a plain split instead of a pattern tried at every character
+  """
+  def __init__(self, word_replacements=WORD_REPLACEMENTS, ampersand_replacements=AMPERSAND_REPLACEMENTS,
+               punctuation_deletions=PUNCTUATION_DELETIONS, leftover_deletions=LEFTOVER_DELETIONS, cache_size=2 ** 16):
+    self.url_pattern = re.compile(r"http\S+")
+    # every contraction key is letters around an apostrophe and writes letters and spaces, so applying the rules
+    # to each run of letters and apostrophes on its own gives the same result as applying them to the sentence;
+    # the symbol rules come after them in the table and neither reads what the other writes
+    self.contraction_replacements = [(old, new) for old, new in word_replacements if "'" in old]
+    self.symbol_replacements = [(old, new) for old, new in word_replacements if "'" not in old]
+    for old, new in self.contraction_replacements:
+      if old.strip(APOSTROPHE_WORD_CHARS) or "'" in new:
+        raise ValueError(f"contraction rule {old!r} -> {new!r} does not stay within a word")
+    for old, _ in self.symbol_replacements:
+      if not old.strip(APOSTROPHE_WORD_CHARS):
+        raise ValueError(f"symbol rule {old!r} needs a character outside letters and apostrophes")
+    self.expand_word = functools.lru_cache(maxsize=cache_size)(self.apply_contractions)
+    self.ampersand_replacements = list(ampersand_replacements)
+    self.punctuation_table = str.maketrans('', '', punctuation_deletions)
+    self.leftover_deletions = list(leftover_deletions)
+
+  def apply_contractions(self, word):
+    for old, new in self.contraction_replacements:
+      word = word.replace(old, new)
+    return word
+
+  def expand_contractions(self, sentence):
+    """
+    Replace each run of letters and apostrophes containing an apostrophe with its rule-by-rule result
+    """
+    letters, expand_word = string.ascii_lowercase, self.expand_word
+    parts = sentence.split("'")
+    between = parts[0].rstrip(letters)
+    pieces = [between]
+    word = parts[0][len(between):]
+    for part in parts[1:]:
+      rest = part.lstrip(letters)
+      if not rest:   # the word goes on to the next apostrophe
+        word += "'" + part
+        continue
+      between = rest.rstrip(letters)
+      pieces.append(expand_word(word + "'" + part[:-len(rest)]))
+      pieces.append(between)
+      word = rest[len(between):]
+    pieces.append(expand_word(word))
+    return ''.join(pieces)
+
+  def normalize(self, sentence):
+    sentence = str(sentence).lower()
+    sentence = unicodedata.normalize('NFKD', sentence).encode('ascii', 'ignore').decode('utf-8', 'ignore') # for converting é to e and other accented chars
+    if 'http' in sentence:
+      sentence = self.url_pattern.sub('', sentence)
+    if "'" in sentence:
+      sentence = self.expand_contractions(sentence)
+    for old, new in self.symbol_replacements:
+      if old in sentence:
+        sentence = sentence.replace(old, new)
+    if '&' in sentence:
+      for old, new in self.ampersand_replacements:
+        sentence = sentence.replace(old, new)
+    sentence = sentence.translate(self.punctuation_table)
+    for old in self.leftover_deletions:
+      sentence = sentence.replace(old, '')
+    sentence = sentence.strip()
+    return sentence
+
+@functools.lru_cache(maxsize=None)
+def get_text_normalizer():
+  return TextNormalizer()
+
+# replacing many abbreviations and lower casing the words
+def process_words(sentence):
+  return get_text_normalizer().normalize(sentence)
+
+# original one-regex-per-rule version of process_words, kept as the reference for benchmark_process_words
+def process_words_legacy(sentence):
+  sentence = str(sentence).lower()
+  sentence = unicodedata.normalize('NFKD', sentence).encode('ascii', 'ignore').decode('utf-8', 'ignore') # for converting é to e and other accented chars
+  sentence = re.sub(r"http\S+","",sentence)
+  sentence = re.sub(r"there's", "there is", sentence)
+  sentence = re.sub(r"i'm", "i am", sentence)
+  sentence = re.sub(r"he's", "he is", sentence)
+  sentence = re.sub(r"she's", "she is", sentence)
+  sentence = re.sub(r"it's", "it is", sentence)
+  sentence = re.sub(r"that's", "that is", sentence)
+  sentence = re.sub(r"what's", "that is", sentence)
+  sentence = re.sub(r"where's", "where is", sentence)
+  sentence = re.sub(r"how's", "how is", sentence)
+  sentence = re.sub(r"\'ll", " will", sentence)
+  sentence = re.sub(r"\'ve", " have", sentence)
+  sentence = re.sub(r"\'re", " are", sentence)
+  sentence = re.sub(r"\'d", " would", sentence)
+  sentence = re.sub(r"\'re", " are", sentence)
+  sentence = re.sub(r"won't", "will not", sentence)
+  sentence = re.sub(r"can't", "can not", sentence)
+  sentence = re.sub(r"n't", " not", sentence)
+  sentence = re.sub(r"n'", "ng", sentence)
+  sentence = re.sub(r"'bout", "about", sentence)
+  sentence = re.sub(r"'til", "until", sentence)
+  sentence = re.sub(r"\$", " usd ", sentence)
+  sentence = re.sub(r"৳", " usd ", sentence)
+  sentence = re.sub(r"₹", " inr ", sentence)
+  sentence = re.sub(r"%", " percent", sentence)
+  sentence = re.sub(r" & ", " and ", sentence)
+  sentence = re.sub(r" &amp ", " and ", sentence)
+  sentence = re.sub(r"&amp", "\&", sentence)
+  sentence = re.sub(r",", "", sentence)
+  sentence = re.sub(r"\"", "", sentence)
+  sentence = re.sub(r"\'", "", sentence)
+  sentence = re.sub(r' s ', "",sentence)
+  sentence = re.sub(r"&#39", "", sentence) # the inshorts data has this in it
+  sentence = re.sub(r"&39", "", sentence) # the inshorts data has this in it
+  sentence = re.sub(r"&#34", "", sentence) # the inshorts data has this in it
+  sentence = re.sub(r"&34", "", sentence) # the inshorts data has this in it
+  sentence = re.sub(r"\\n", "", sentence)
+  sentence = sentence.strip()
+  return sentence
+
+EMOJI_PATTERN = re.compile("["
+  u"\U0001F600-\U0001F64F"    # emoticons
+  u"\U0001F300-\U0001F5FF"    # symbols & pictographs
+  u"\U0001F680-\U0001F6FF"    # transport & map symbols
+  u"\U0001F1E0-\U0001F1FF"    # flags (iOS)
+  u"\U00002500-\U00002BEF"    # chinese char
+  u"\U00002702-\U000027B0"
+  u"\U00002702-\U000027B0"
+  u"\U000024C2-\U0001F251"
+  u"\U0001f926-\U0001f937"
+  u"\U00010000-\U0010ffff"
+  u"\u2640-\u2642"
+  u"\u2600-\u2B55"
+  u"\u200d"
+  u"\u23cf"
+  u"\u23e9"
+  u"\u231a"
+  u"\ufe0f"
+  u"\u3030"
+  "]+", re.UNICODE)
+
+# remove unnecessary characters and transforming colloquial word to its common form
+def clean_sentences(text):
+  text = text.lower()                                                             # make lowercase letters
+  text = re.sub(EMOJI_PATTERN, '', text)                                          # remove emoji
+  text = re.sub(r'(.)\1{2,}', r'\1', text)                                        # change the repeated letters above 2 times to just 1
+  text = re.sub("[\-_;:]", " ", text)                                            # remove -, _ and :
+  text = re.sub("[¹²³¹⁰ⁱ⁴⁵⁶⁷⁸⁹⁺⁻⁼⁽⁾ⁿ]", "", text)                                 # remove power character
+  text = re.sub(r"From|\S*@\S*\s?|Subject", "", text)                             # remove email starts
+  text = re.sub("[^\w\s]*[_.!?#&;:><+-/)/(\'\"]", " ", text)                     # remove not string and whitespace
+  text = re.sub("\s+", " ", text)                                                 # remove extra spaces
+  text = re.sub(" +", " ", text.strip())                                          # Remove unnecessary white space
+  return text
+
+# Eliminate stopwords and suffixes
+def remove_stopwords(text):
+  list_stopwords = set(english_stopwords())                                   # stopword from nltk
+  list_stopwords.remove('no')                                                 # remove 'no' and 'no' from list_stopwords
+  list_stopwords.remove('not')
+  text = " ".join(w if w not in list_stopwords else '' for w in text.split())
+  text = re.sub(" +", " ", text.strip())                                      # Remove unnecessary white space
+  return text
+
+class TextCleaner:
+  """
+  process_words, clean_sentences and remove_stopwords with the stopword set and regexes prepared once
+  """
+  def __init__(self, normalizer=None, keep_words=('no', 'not')):
+    self.normalizer = normalizer if normalizer is not None else get_text_normalizer()
+    self.stopwords = set(english_stopwords()) - set(keep_words)
+    self.emoji_pattern = EMOJI_PATTERN
+    self.repeated_pattern = re.compile(r'(.)\1{2,}')
+    self.separator_pattern = re.compile(r"[\-_;:]")
+    self.power_pattern = re.compile("[¹²³¹⁰ⁱ⁴⁵⁶⁷⁸⁹⁺⁻⁼⁽⁾ⁿ]")
+    self.email_pattern = re.compile(r"From|\S*@\S*\s?|Subject")
+    self.symbol_pattern = re.compile(r"[^\w\s]*[_.!?#&;:><+-/)/(\'\"]")
+
+  def clean_sentence(self, text):
+    text = text.lower()
+    text = self.emoji_pattern.sub('', text)
+    text = self.repeated_pattern.sub(r'\1', text)
+    text = self.separator_pattern.sub(' ', text)
+    text = self.power_pattern.sub('', text)
+    text = self.email_pattern.sub('', text)
+    text = self.symbol_pattern.sub(' ', text)
+    return ' '.join(text.split())
+
+  def remove_stopwords(self, text):
+    return ' '.join(w for w in text.split() if w not in self.stopwords)
+
+  def clean(self, text):
+    text = self.normalizer.normalize(text)
+    text = self.clean_sentence(text)
+    text = self.remove_stopwords(text)
+    return text
+
+  def clean_many(self, texts):
+    return [self.clean(text) for text in texts]
+
+@functools.lru_cache(maxsize=None)
+def get_text_cleaner():
+  return TextCleaner()
+
+def clean_text(text):
+  stage_metrics.count('cleaned_texts')
+  with stage_metrics.stage('clean'):
+    return get_text_cleaner().clean(text)
+
+def clean_chunk(texts):
+  return get_text_cleaner().clean_many(texts)
+
+def clean_texts_parallel(texts, num_workers=None, chunk_size=1000):
+  """
+  Clean texts across a process pool, returning results in the original order
+  """
+  texts = list(texts)
+  num_workers = num_workers or os.cpu_count() or 1
+  stage_metrics.count('cleaned_texts', len(texts))
+  with stage_metrics.stage('clean'):
+    if num_workers == 1 or len(texts) <= chunk_size:
+      return get_text_cleaner().clean_many(texts)
+
+    chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+      cleaned = []
+      for chunk in executor.map(clean_chunk, chunks):   # map yields in submission order
+        cleaned.extend(chunk)
+    return cleaned
+
+def clean_df(df, col_name, num_workers=1, chunk_size=1000):
+  df[col_name] = clean_texts_parallel(df[col_name], num_workers=num_workers, chunk_size=chunk_size)
+
+  return df
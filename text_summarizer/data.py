@@ -0,0 +1,233 @@
+"""
+Tokenized datasets, batching and article readers
+"""
+import csv
+import hashlib
+import json
+import os
+import queue
+import threading
+
+import numpy as np
+import torch
+
+class PegasusDataset(torch.utils.data.Dataset):
+  """
+  Token ids of every row packed into one flat int32 buffer plus offsets, items are views into it
+  """
+  def __init__(self, encodings, labels):
+    self.input_ids, self.input_offsets = self.pack(encodings['input_ids'])
+    self.label_ids, self.label_offsets = self.pack(labels['input_ids'])
+    # unpadded rows attend to every token, so masks are views of one shared row of ones
+    self.ones = torch.ones(int(self.lengths.max(initial=0)), dtype=torch.int32).share_memory_()
+
+  @staticmethod
+  def pack(sequences):
+    lengths = np.fromiter((len(seq) for seq in sequences), dtype=np.int64, count=len(sequences))
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    flat = np.concatenate([np.asarray(seq, dtype=np.int32) for seq in sequences]) if len(sequences) else np.zeros(0, dtype=np.int32)
+    # shared memory lets DataLoader workers map the buffer instead of receiving a pickled copy
+    return torch.from_numpy(flat).share_memory_(), offsets
+
+  @property
+  def lengths(self):
+    return np.diff(self.input_offsets)
+
+  def __getitem__(self, idx):
+    start, end = int(self.input_offsets[idx]), int(self.input_offsets[idx + 1])
+    label_start, label_end = int(self.label_offsets[idx]), int(self.label_offsets[idx + 1])
+    return {
+      'input_ids': self.input_ids[start:end],
+      'attention_mask': self.ones[:end - start],
+      'labels': self.label_ids[label_start:label_end],
+    }
+
+  def __len__(self):
+    return len(self.label_offsets) - 1
+
+class PegasusDataCollator:
+  """
+  Pads each batch only to its own longest input and label instead of the longest row in the split
+  """
+  def __init__(self, tokenizer, label_pad_token_id=-100, pad_to_multiple_of=None):
+    self.pad_token_id = tokenizer.pad_token_id
+    self.label_pad_token_id = label_pad_token_id    # -100 keeps label padding out of the loss
+    self.pad_to_multiple_of = pad_to_multiple_of
+
+  def pad(self, sequences, value):
+    max_len = max(len(seq) for seq in sequences)
+    if self.pad_to_multiple_of:
+      max_len = -(-max_len // self.pad_to_multiple_of) * self.pad_to_multiple_of
+    batch = torch.full((len(sequences), max_len), value, dtype=torch.long)
+    for i, seq in enumerate(sequences):
+      batch[i, :len(seq)] = torch.as_tensor(seq, dtype=torch.long)
+    return batch
+
+  def __call__(self, features):
+    batch = {}
+    for key in features[0]:
+      if key == 'labels':
+        value = self.label_pad_token_id
+      elif key == 'attention_mask':
+        value = 0
+      else:
+        value = self.pad_token_id
+      batch[key] = self.pad([feature[key] for feature in features], value)
+    return batch
+
+class TokenCache:
+  """
+  Memory-mapped on-disk cache of token ids, keyed by text hash, tokenizer and truncation settings
+  """
+  index_dtype = np.dtype([('key', 'S32'), ('offset', np.int64), ('length', np.int64)])
+
+  def __init__(self, cache_dir, tokenizer, truncation=True, max_length=None):
+    from transformers import __version__ as transformers_version
+    self.tokenizer = tokenizer
+    self.truncation = truncation
+    self.max_length = max_length
+    settings = json.dumps([type(tokenizer).__name__, tokenizer.name_or_path, len(tokenizer), transformers_version,
+                           truncation, max_length or tokenizer.model_max_length])
+    self.path = os.path.join(cache_dir, hashlib.sha1(settings.encode('utf-8')).hexdigest()[:16])
+    os.makedirs(self.path, exist_ok=True)
+    self.ids_path = os.path.join(self.path, 'ids.bin')
+    self.index_path = os.path.join(self.path, 'index.npy')
+
+    self.index = {}
+    if os.path.exists(self.index_path):
+      index = np.load(self.index_path)
+      self.index = dict(zip(index['key'].tolist(), zip(index['offset'].tolist(), index['length'].tolist())))
+    self.load_ids()
+
+  @staticmethod
+  def key(text):
+    return hashlib.blake2b(str(text).encode('utf-8'), digest_size=16).hexdigest().encode('ascii')
+
+  def load_ids(self):
+    if os.path.exists(self.ids_path) and os.path.getsize(self.ids_path) > 0:
+      self.ids = np.memmap(self.ids_path, dtype=np.int32, mode='r')
+    else:
+      self.ids = np.zeros(0, dtype=np.int32)
+
+  def save_index(self):
+    index = np.array([(key, offset, length) for key, (offset, length) in self.index.items()], dtype=self.index_dtype)
+    tmp_path = self.index_path + '.tmp.npy'
+    np.save(tmp_path, index)
+    os.replace(tmp_path, self.index_path)   # ids are appended before the index that points at them is swapped in
+
+  def encode(self, texts):
+    """
+    Return token ids for each text as views into the memory map, tokenizing only texts not cached yet
+    """
+    texts = [str(text) for text in texts]
+    keys = [self.key(text) for text in texts]
+    missing = {}
+    for key, text in zip(keys, texts):
+      if key not in self.index:
+        missing.setdefault(key, text)
+
+    if missing:
+      encoded = self.tokenizer(list(missing.values()), truncation=self.truncation, max_length=self.max_length)['input_ids']
+      offset = os.path.getsize(self.ids_path) // 4 if os.path.exists(self.ids_path) else 0
+      with open(self.ids_path, 'ab') as f:
+        for key, ids in zip(missing, encoded):
+          row = np.asarray(ids, dtype=np.int32)
+          f.write(row.tobytes())
+          self.index[key] = (offset, len(row))
+          offset += len(row)
+      self.save_index()
+      self.load_ids()
+
+    return [self.ids[offset:offset + length] for offset, length in (self.index[key] for key in keys)]
+
+def prepare_data(model_name,
+                 train_texts, train_labels,
+                 val_texts=None, val_labels=None,
+                 test_texts=None, test_labels=None,
+                 tokenizer = None,
+                 cache_dir = None,):
+  """
+  Prepare input data for model fine-tuning
+  """
+  if tokenizer is None:
+    from transformers import PegasusTokenizer
+    tokenizer = PegasusTokenizer.from_pretrained(model_name)
+  token_cache = TokenCache(cache_dir, tokenizer) if cache_dir is not None else None
+
+  prepare_val = False if val_texts is None or val_labels is None else True
+  prepare_test = False if test_texts is None or test_labels is None else True
+
+  def tokenize_data(texts, labels):
+    # rows are stored unpadded, PegasusDataCollator pads each batch to its own longest row
+    if token_cache is not None:
+      encodings = {'input_ids': token_cache.encode(texts)}
+      decodings = {'input_ids': token_cache.encode(labels)}
+    else:
+      encodings = tokenizer(texts, truncation=True)
+      decodings = tokenizer(labels, truncation=True)
+    dataset_tokenized = PegasusDataset(encodings, decodings)
+    return dataset_tokenized
+
+  train_dataset = tokenize_data(train_texts, train_labels)
+  val_dataset = tokenize_data(val_texts, val_labels) if prepare_val else None
+  test_dataset = tokenize_data(test_texts, test_labels) if prepare_test else None
+
+  return train_dataset, val_dataset, test_dataset, tokenizer
+
+def read_articles(path):
+  """
+  Yield (row, record) pairs from a csv, jsonl or xlsx file one row at a time
+  """
+  ext = os.path.splitext(path)[1].lower()
+  if ext == '.csv':
+    with open(path, newline='', encoding='utf-8') as f:
+      yield from enumerate(csv.DictReader(f))
+  elif ext in ('.jsonl', '.json'):
+    with open(path, encoding='utf-8') as f:
+      yield from enumerate(json.loads(line) for line in f if line.strip())
+  elif ext == '.xlsx':
+    from openpyxl import load_workbook
+    workbook = load_workbook(path, read_only=True)   # read_only streams rows instead of loading the sheet
+    try:
+      rows = workbook.active.iter_rows(values_only=True)
+      header = [str(name) for name in next(rows)]
+      yield from enumerate(dict(zip(header, values)) for values in rows)
+    finally:
+      workbook.close()
+  else:
+    raise ValueError(f"unsupported input format: {path}")
+
+def prefetch(iterable, max_items):
+  """
+  Run iterable in a background thread, staying at most max_items ahead of the consumer
+  """
+  items = queue.Queue(maxsize=max_items)
+  done = object()
+
+  def produce():
+    try:
+      for item in iterable:
+        items.put((item, None))
+      items.put((done, None))
+    except Exception as error:
+      items.put((done, error))
+
+  threading.Thread(target=produce, daemon=True).start()
+  while True:
+    item, error = items.get()
+    if item is done:
+      if error is not None:
+        raise error
+      return
+    yield item
+
+def batched(iterable, batch_size):
+  batch = []
+  for item in iterable:
+    batch.append(item)
+    if len(batch) == batch_size:
+      yield batch
+      batch = []
+  if batch:
+    yield batch
@@ -0,0 +1,197 @@
+"""
+Near-duplicate detection with MinHash signatures and locality sensitive hashing
+"""
+import logging
+import zlib
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .cleaning import clean_text
+
+logger = logging.getLogger(__name__)
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+
+def lsh_bands(num_perm, threshold):
+  """
+  Band count and rows per band with the highest candidate threshold (1 / bands) ** (1 / rows) still below threshold,
+  so pairs just above it are rarely missed and the extra candidates are dropped when their signatures are compared
+  """
+  options = [(num_perm // rows, rows) for rows in range(1, num_perm + 1) if num_perm % rows == 0]
+  below = [option for option in options if (1 / option[0]) ** (1 / option[1]) <= threshold]
+  return max(below, key=lambda option: option[1]) if below else options[0]
+
+class MinHasher:
+  """
+  MinHash signatures over word shingles of clean_text output
+  """
+  def __init__(self, num_perm=128, shingle_size=3, seed=0):
+    rng = np.random.default_rng(seed)
+    self.num_perm = num_perm
+    self.shingle_size = shingle_size
+    # universal hashes (a * x + b) mod p, the same permutation family datasketch uses
+    self.a = rng.integers(1, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+    self.b = rng.integers(0, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+
+  def shingle_hashes(self, text):
+    words = clean_text(text).split()
+    if not words:
+      return np.zeros(0, dtype=np.uint64)
+    k = min(self.shingle_size, len(words))
+    shingles = {" ".join(words[i:i + k]) for i in range(len(words) - k + 1)}
+    # crc32 is stable across processes, unlike hash()
+    return np.fromiter((zlib.crc32(shingle.encode('utf-8')) for shingle in shingles), dtype=np.uint64, count=len(shingles))
+
+  def signature(self, text):
+    hashes = self.shingle_hashes(text)
+    if not len(hashes):
+      return np.full(self.num_perm, MAX_HASH, dtype=np.uint32)
+    # uint64 products wrap around like datasketch's, which keeps the hash family usable
+    permuted = (self.a[:, None] * hashes[None, :] + self.b[:, None]) % MERSENNE_PRIME & MAX_HASH
+    return permuted.min(axis=1).astype(np.uint32)
+
+  def signatures(self, texts):
+    signatures = np.empty((len(texts), self.num_perm), dtype=np.uint32)
+    for i, text in enumerate(texts):
+      signatures[i] = self.signature(text)
+    return signatures
+
+  def signatures_parallel(self, texts, num_workers=1, chunk_size=1000):
+    """
+    Signatures of texts across a process pool, rows in the original order
+    """
+    texts = list(texts)
+    if num_workers == 1 or len(texts) <= chunk_size:
+      return self.signatures(texts)
+    chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+      return np.concatenate(list(executor.map(self.signatures, chunks)))
+
+def band_multipliers(rows, seed=0):
+  return np.random.default_rng(seed + 1).integers(1, 1 << 63, size=rows, dtype=np.uint64) | np.uint64(1)
+
+def band_keys(signatures, num_bands, multipliers):
+  """
+  One uint64 hash per LSH band for each signature row, shape (rows, bands)
+  """
+  bands = signatures.astype(np.uint64).reshape(len(signatures), num_bands, len(multipliers))
+  return (bands * multipliers).sum(axis=2)
+
+def estimated_similarity(signature, other):
+  # share of equal minhashes estimates the Jaccard similarity of the shingle sets
+  return np.mean(signature == other, axis=-1)
+
+class UnionFind:
+  def __init__(self, size):
+    self.parent = list(range(size))
+
+  def find(self, x):
+    parent = self.parent
+    while parent[x] != x:
+      parent[x] = parent[parent[x]]
+      x = parent[x]
+    return x
+
+  def union(self, x, y):
+    root_x, root_y = self.find(x), self.find(y)
+    if root_x != root_y:
+      self.parent[max(root_x, root_y)] = min(root_x, root_y)   # the earliest row stays the representative
+
+class NearDuplicateIndex:
+  """
+  LSH index of MinHash signatures, answering near-duplicate queries without comparing every pair
+  """
+  def __init__(self, threshold=0.8, num_perm=128, shingle_size=3, seed=0):
+    self.threshold = threshold
+    self.hasher = MinHasher(num_perm, shingle_size, seed)
+    self.num_bands, self.rows = lsh_bands(num_perm, threshold)
+    self.multipliers = band_multipliers(self.rows, seed)
+    self.buckets = [{} for _ in range(self.num_bands)]   # per band: band hash -> positions
+    self.ids = []
+    self.signature_rows = []
+
+  def add(self, texts, ids=None, signatures=None):
+    if signatures is None:
+      signatures = self.hasher.signatures(texts)
+    ids = list(range(len(self.ids), len(self.ids) + len(signatures))) if ids is None else list(ids)
+    start = len(self.ids)
+    self.ids.extend(ids)
+    self.signature_rows.extend(signatures)
+    for offset, keys in enumerate(band_keys(signatures, self.num_bands, self.multipliers).tolist()):
+      if (signatures[offset] == MAX_HASH).all():
+        continue   # texts without words are never near-duplicates of anything
+      for band, key in enumerate(keys):
+        self.buckets[band].setdefault(key, []).append(start + offset)
+
+  def query(self, text=None, signature=None):
+    """
+    (id, estimated similarity) of indexed texts at or above the threshold, most similar first
+    """
+    if signature is None:
+      signature = self.hasher.signature(text)
+    if (signature == MAX_HASH).all():
+      return []
+    candidates = set()
+    for band, key in enumerate(band_keys(signature[None, :], self.num_bands, self.multipliers)[0].tolist()):
+      candidates.update(self.buckets[band].get(key, ()))
+    matches = []
+    for position in candidates:
+      similarity = float(estimated_similarity(signature, self.signature_rows[position]))
+      if similarity >= self.threshold:
+        matches.append((self.ids[position], similarity))
+    return sorted(matches, key=lambda match: -match[1])
+
+  def __len__(self):
+    return len(self.ids)
+
+def near_duplicate_clusters(signatures, threshold=0.8, num_bands=None, rows=None, seed=0):
+  """
+  Root row of every signature row after joining rows that share an LSH bucket and reach the threshold,
+  using one sort per band instead of comparing all pairs
+  """
+  n, num_perm = signatures.shape
+  if num_bands is None:
+    num_bands, rows = lsh_bands(num_perm, threshold)
+  keys = band_keys(signatures, num_bands, band_multipliers(rows, seed))
+  valid = ~(signatures == MAX_HASH).all(axis=1)
+
+  union_find = UnionFind(n)
+  for band in range(num_bands):
+    order = np.argsort(keys[:, band], kind='stable')
+    order = order[valid[order]]
+    if not len(order):
+      continue
+    bucket_keys = keys[order, band]
+    # every row is linked to the first row of its bucket if their signatures agree enough
+    run_starts = np.r_[True, bucket_keys[1:] != bucket_keys[:-1]]
+    firsts = order[np.maximum.accumulate(np.where(run_starts, np.arange(len(order)), 0))]
+    linked = (firsts != order) & (estimated_similarity(signatures[firsts], signatures[order]) >= threshold)
+    for first, row in zip(firsts[linked].tolist(), order[linked].tolist()):
+      union_find.union(first, row)
+  return np.array([union_find.find(row) for row in range(n)])
+
+def dedup_splits(splits, threshold=0.8, num_workers=1, chunk_size=1000, **hasher_kwargs):
+  """
+  Drop near-duplicate articles from dict of name -> (texts, labels) splits, given in priority order:
+  a cluster keeps its first article in the highest priority split, so test articles are never also trained on
+  """
+  names = list(splits)
+  texts = [text for name in names for text in splits[name][0]]
+
+  signatures = MinHasher(**hasher_kwargs).signatures_parallel(texts, num_workers=num_workers, chunk_size=chunk_size)
+  roots = near_duplicate_clusters(signatures, threshold, seed=hasher_kwargs.get('seed', 0))
+  # roots are the earliest row of each cluster, and rows are laid out in priority order
+  keep = roots == np.arange(len(texts))
+
+  deduped, start = {}, 0
+  for name in names:
+    split_texts, split_labels = splits[name]
+    split_keep = keep[start:start + len(split_texts)]
+    deduped[name] = ([text for text, kept in zip(split_texts, split_keep) if kept],
+                     [label for label, kept in zip(split_labels, split_keep) if kept])
+    logger.info("%s: kept %d of %d articles", name, int(split_keep.sum()), len(split_texts))
+    start += len(split_texts)
+  return deduped
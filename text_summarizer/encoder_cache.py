@@ -0,0 +1,115 @@
+"""
+Encoder states computed once per article and shared by several decoding configurations
+"""
+import collections
+import hashlib
+import threading
+
+import torch
+
+from .resources import resolve_model
+from .summary_cache import model_id
+
+class EncoderCache:
+  """
+  LRU of recent encoder hidden states, one unpadded (sequence, hidden) tensor per text and model
+  """
+  def __init__(self, max_entries=256):
+    self.max_entries = max_entries
+    self.states = collections.OrderedDict()   # key -> hidden states, oldest access first
+    self.lock = threading.Lock()
+    self.counters = collections.Counter()
+
+  @staticmethod
+  def key(text, model_name):
+    return hashlib.blake2b((model_name + "\0" + text).encode('utf-8'), digest_size=16).hexdigest()
+
+  def get(self, key):
+    with self.lock:
+      states = self.states.get(key)
+      if states is None:
+        self.counters['misses'] += 1
+        return None
+      self.states.move_to_end(key)
+      self.counters['hits'] += 1
+      return states
+
+  def put(self, key, states):
+    with self.lock:
+      self.states[key] = states
+      self.states.move_to_end(key)
+      while len(self.states) > self.max_entries:
+        self.states.popitem(last=False)
+        self.counters['evictions'] += 1
+
+  def stats(self):
+    with self.lock:
+      stats = {name: self.counters[name] for name in ('hits', 'misses', 'evictions')}
+      stats['entries'] = len(self.states)
+    return stats
+
+  def clear(self):
+    with self.lock:
+      self.states.clear()
+      self.counters.clear()
+
+def encode(texts, model, tokenizer, cache=None):
+  """
+  Encoder hidden states of each text, unpadded, running the encoder in one padded batch for the texts cache does not hold
+  """
+  texts = [str(text) for text in texts]
+  model_name = model_id(model)
+  keys = [EncoderCache.key(text, model_name) for text in texts]
+  states = [None] * len(texts) if cache is None else [cache.get(key) for key in keys]
+  missing = [idx for idx, state in enumerate(states) if state is None]
+  if missing:
+    tokens = tokenizer([texts[idx] for idx in missing], truncation=True, padding=True, return_tensors="pt").to(model.device)
+    with torch.inference_mode():
+      hidden_states = model.get_encoder()(**tokens).last_hidden_state
+    lengths = tokens['attention_mask'].sum(dim=1).tolist()
+    for row, idx in enumerate(missing):
+      # a copy, so a cached entry does not keep the whole padded batch alive
+      states[idx] = hidden_states[row, :lengths[row]].clone()
+      if cache is not None:
+        cache.put(keys[idx], states[idx])
+  return states
+
+def pad_states(states):
+  """
+  (hidden_states, attention_mask) batch of unpadded encoder states, padded positions are masked out
+  """
+  max_length = max(len(state) for state in states)
+  hidden_states = states[0].new_zeros((len(states), max_length, states[0].shape[-1]))
+  attention_mask = torch.zeros((len(states), max_length), dtype=torch.long, device=states[0].device)
+  for row, state in enumerate(states):
+    hidden_states[row, :len(state)] = state
+    attention_mask[row, :len(state)] = 1
+  return hidden_states, attention_mask
+
+def summarize_variants(texts, configs, batch_size=8, model=None, tokenizer=None, cache=None):
+  """
+  Summaries of every text under each named set of generate kwargs, e.g. {'headline': {'max_length': 16},
+  'blurb': {'max_length': 64, 'num_beams': 8}}, encoding each text once for all of them
+  """
+  from transformers.modeling_outputs import BaseModelOutput
+
+  model, tokenizer = resolve_model(model, tokenizer)
+  summaries = [{} for _ in texts]
+  lengths = [len(ids) for ids in tokenizer([str(text) for text in texts], truncation=True)['input_ids']]
+  order = sorted(range(len(texts)), key=lambda idx: lengths[idx], reverse=True)
+
+  for start in range(0, len(order), batch_size):
+    batch_idx = order[start:start + batch_size]
+    hidden_states, attention_mask = pad_states(encode([texts[idx] for idx in batch_idx], model, tokenizer, cache))
+    for name, generate_kwargs in configs.items():
+      # generate skips the encoder when given its outputs, and expands them in place for beam search,
+      # so every config gets its own output object around the shared states
+      encoder_outputs = BaseModelOutput(last_hidden_state=hidden_states)
+      with torch.inference_mode():
+        summary = model.generate(encoder_outputs=encoder_outputs, attention_mask=attention_mask, **generate_kwargs)
+      for idx, pred_summary in zip(batch_idx, tokenizer.batch_decode(summary, skip_special_tokens=True)):
+        summaries[idx][name] = pred_summary
+  return summaries
+
+def get_summary_variants(text, configs, model=None, tokenizer=None, cache=None):
+  return summarize_variants([text], configs, batch_size=1, model=model, tokenizer=tokenizer, cache=cache)[0]
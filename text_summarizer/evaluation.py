@@ -0,0 +1,94 @@
+"""
+Corpus-level evaluation, runnable as python -m text_summarizer.evaluation
+"""
+import argparse
+import itertools
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+from .data import read_articles
+from .inference import iter_summary_batches
+from .metrics import ROUGE_KEYS, rouge_scorer
+from .resources import DEFAULT_MODEL_NAME, load_model
+
+def evaluate(model, tokenizer, texts, labels, batch_size=8, output_path=None, **generate_kwargs):
+  """
+  Summarize and score a corpus in one aggregated pass, reporting throughput and latency percentiles;
+  an article's latency is the wall time of the batch it was generated in, since it waits for the whole batch
+  """
+  texts, labels = [str(text) for text in texts], [str(label) for label in labels]
+  predictions = [None] * len(texts)
+  batch_latencies, article_latencies = [], []
+
+  start = batch_start = time.perf_counter()
+  for batch_idx, batch_summaries in iter_summary_batches(model, tokenizer, texts, batch_size, **generate_kwargs):
+    seconds = time.perf_counter() - batch_start
+    batch_latencies.append(seconds)
+    article_latencies.extend([seconds] * len(batch_idx))
+    for idx, pred_summary in zip(batch_idx, batch_summaries):
+      predictions[idx] = pred_summary
+    batch_start = time.perf_counter()
+  generation_seconds = time.perf_counter() - start
+
+  scores = rouge_scorer.score(predictions, labels)
+  if output_path is not None:
+    df_scores = pd.DataFrame(scores, columns=ROUGE_KEYS)
+    df_scores.insert(0, 'prediction', predictions)
+    df_scores.insert(1, 'reference', labels)
+    df_scores.to_parquet(output_path, index=False)
+
+  report = {key: round(value, 4) for key, value in zip(ROUGE_KEYS, scores.mean(axis=0).tolist())}
+  report.update({
+    'num_articles': len(texts),
+    'generation_seconds': round(generation_seconds, 3),
+    'articles_per_sec': round(len(texts) / generation_seconds, 3),
+    'article_seconds_amortized': round(generation_seconds / max(len(texts), 1), 4),
+  })
+  for name, latencies in (('batch', batch_latencies), ('article', article_latencies)):
+    for q in (50, 95, 99):
+      report[f'{name}_latency_p{q}'] = round(float(np.percentile(latencies, q)), 4)
+  return report
+
+def read_slice(path, start, size, text_column, label_column):
+  """
+  Texts and labels of a row slice: snapshot rows as snapshot_split numbers them (entities decoded, incomplete
+  rows dropped), or raw file rows with incomplete ones skipped after slicing
+  """
+  if path.endswith('.arrow'):
+    from .snapshot import load_snapshot, snapshot_split
+    return snapshot_split(load_snapshot(path), start, size, text_column, label_column)
+  records = [record for _, record in itertools.islice(read_articles(path), start, start + size)
+             if record.get(text_column) is not None and record.get(label_column) is not None]
+  return [record[text_column] for record in records], [record[label_column] for record in records]
+
+def evaluate_cli(argv=None):
+  """
+  Command line entry for evaluate on a row slice of an arrow snapshot or a csv, jsonl or xlsx dataset
+  """
+  parser = argparse.ArgumentParser(description="Evaluate a Pegasus summarizer on a slice of a dataset")
+  parser.add_argument('data', help="arrow snapshot, or csv, jsonl or xlsx file with text and label columns")
+  parser.add_argument('--model', default=DEFAULT_MODEL_NAME, help="model name or local directory")
+  parser.add_argument('--start', type=int, default=0,
+                      help="first row of the slice, counted like snapshot_split for a snapshot and as raw file rows otherwise")
+  parser.add_argument('--size', type=int, default=1000, help="number of rows in the slice")
+  parser.add_argument('--text-column', default='long')
+  parser.add_argument('--label-column', default='short')
+  parser.add_argument('--batch-size', type=int, default=8)
+  parser.add_argument('--num-beams', type=int, default=None)
+  parser.add_argument('--output', default=None, help="parquet file for per-example scores")
+  args = parser.parse_args(argv)
+
+  texts, labels = read_slice(args.data, args.start, args.size, args.text_column, args.label_column)
+  eval_tokenizer, eval_model = load_model(args.model)
+  generate_kwargs = {'num_beams': args.num_beams} if args.num_beams else {}
+
+  report = evaluate(eval_model, eval_tokenizer, texts, labels, batch_size=args.batch_size, output_path=args.output,
+                    **generate_kwargs)
+  print(json.dumps(report, indent=2))
+  return report
+
+if __name__ == '__main__':
+  evaluate_cli()
@@ -0,0 +1,79 @@
+"""
+Extractive sentence pre-selection, shrinking articles to their salient sentences before Pegasus reads them
+"""
+import numpy as np
+
+from .cleaning import get_text_cleaner
+from .resources import split_sentences
+
+class ExtractiveSelector:
+  """
+  Keep the highest ranked sentences of each text, in their original order, within token_budget tokens
+  """
+  def __init__(self, tokenizer=None, token_budget=256, max_sentences=None, method='textrank', damping=0.85, iterations=50):
+    if method not in ('textrank', 'tfidf'):
+      raise ValueError(f"unknown ranking method: {method}")
+    self.tokenizer = tokenizer
+    self.token_budget = token_budget
+    self.max_sentences = max_sentences
+    self.method = method
+    self.damping = damping
+    self.iterations = iterations
+    self.cleaner = get_text_cleaner()
+
+  def tfidf(self, sentences):
+    """
+    L2-normalized tf-idf rows of the sentences over their stopword-free cleaned words
+    """
+    vocab = {}
+    terms = [[vocab.setdefault(word, len(vocab)) for word in self.cleaner.clean(sentence).split()] for sentence in sentences]
+    # an article has tens of sentences and a few hundred terms, small enough for a dense matrix
+    counts = np.zeros((len(sentences), max(len(vocab), 1)))
+    for row, ids in enumerate(terms):
+      np.add.at(counts[row], ids, 1)
+    idf = np.log((1 + len(sentences)) / (1 + np.count_nonzero(counts, axis=0))) + 1
+    weights = counts * idf
+    norms = np.linalg.norm(weights, axis=1, keepdims=True)
+    return np.divide(weights, norms, out=np.zeros_like(weights), where=norms > 0)
+
+  def scores(self, sentences):
+    weights = self.tfidf(sentences)
+    if self.method == 'tfidf':
+      # closeness to the article's centroid
+      return weights @ weights.sum(axis=0)
+
+    similarity = weights @ weights.T
+    np.fill_diagonal(similarity, 0)
+    out_weight = similarity.sum(axis=1, keepdims=True)
+    # sentences sharing no terms with the rest link to every sentence equally
+    transition = np.divide(similarity, out_weight, out=np.full_like(similarity, 1 / len(sentences)), where=out_weight > 0)
+    rank = np.full(len(sentences), 1 / len(sentences))
+    for _ in range(self.iterations):
+      updated = (1 - self.damping) / len(sentences) + self.damping * (transition.T @ rank)
+      if np.abs(updated - rank).sum() < 1e-6:
+        return updated
+      rank = updated
+    return rank
+
+  def select(self, text):
+    sentences = split_sentences(text)
+    if len(sentences) <= 1:
+      return str(text)
+    lengths = [len(sentence.split()) for sentence in sentences]
+    if self.tokenizer is not None:
+      lengths = [len(ids) for ids in self.tokenizer(sentences, add_special_tokens=False)['input_ids']]
+    if sum(lengths) <= self.token_budget and (self.max_sentences is None or len(sentences) <= self.max_sentences):
+      return str(text)
+
+    chosen, used = [], 0
+    for idx in np.argsort(-self.scores(sentences), kind='stable').tolist():
+      if self.max_sentences is not None and len(chosen) == self.max_sentences:
+        break
+      if chosen and used + lengths[idx] > self.token_budget:
+        continue   # a shorter, lower ranked sentence may still fit
+      chosen.append(idx)
+      used += lengths[idx]
+    return " ".join(sentences[idx] for idx in sorted(chosen))
+
+  def __call__(self, texts):
+    return [self.select(text) for text in texts]
@@ -0,0 +1,122 @@
+"""
+Batched and streaming summarization
+"""
+import json
+import os
+
+import torch
+
+from .cleaning import clean_text
+from .data import batched, prefetch, read_articles
+from .instrumentation import stage_metrics
+from .resources import resolve_model
+from .summary_cache import model_id
+
+def iter_summary_batches(model, tokenizer, texts, batch_size=8, **generate_kwargs):
+  """
+  Yield (indices, summaries) per padded micro-batch, with texts sorted by token length
+  """
+  with stage_metrics.stage('tokenize'):
+    encodings = tokenizer([str(text) for text in texts], truncation=True)
+  order = sorted(range(len(texts)), key=lambda idx: len(encodings['input_ids'][idx]), reverse=True)
+
+  for start in range(0, len(order), batch_size):
+    batch_idx = order[start:start + batch_size]
+    with stage_metrics.stage('pad'):
+      tokens = tokenizer.pad({key: [encodings[key][idx] for idx in batch_idx] for key in encodings}, return_tensors="pt").to(model.device)
+    with stage_metrics.stage('generate'), torch.inference_mode():
+      summary = model.generate(**tokens, **generate_kwargs)
+    with stage_metrics.stage('decode'):
+      batch_summaries = tokenizer.batch_decode(summary, skip_special_tokens=True)
+    if stage_metrics.enabled:
+      stage_metrics.count('summarized_texts', len(batch_idx))
+      stage_metrics.observe('batch_size', len(batch_idx))
+      stage_metrics.observe('input_tokens', int(tokens['attention_mask'].sum()))
+      stage_metrics.observe('output_tokens', int((summary != tokenizer.pad_token_id).sum()))
+    yield batch_idx, batch_summaries
+
+def summarize_batch(texts, batch_size=8, model=None, tokenizer=None, cache=None, selector=None, **generate_kwargs):
+  """
+  Summarize texts in padded micro-batches of similar token length, returning summaries in input order,
+  generating only the texts a SummaryCache does not already hold
+  """
+  model, tokenizer = resolve_model(model, tokenizer)
+  if selector is not None:
+    texts = selector(texts)   # extractive pre-selection, e.g. an ExtractiveSelector
+  summaries = [None] * len(texts)
+  if cache is None:
+    for batch_idx, batch_summaries in iter_summary_batches(model, tokenizer, texts, batch_size, **generate_kwargs):
+      for idx, pred_summary in zip(batch_idx, batch_summaries):
+        summaries[idx] = pred_summary
+    return summaries
+
+  model_name = model_id(model)
+  pending = {}   # key -> positions of every text with that key, so repeats within texts are generated once
+  for idx, text in enumerate(texts):
+    key = cache.key(text, model_name, generate_kwargs)
+    if key in pending:
+      pending[key].append(idx)
+      continue
+    summaries[idx] = cache.get(key)
+    if summaries[idx] is None:
+      summaries[idx] = cache.get_near_duplicate(text, model_name, generate_kwargs)
+    if summaries[idx] is None:
+      pending[key] = [idx]
+
+  keys = list(pending)
+  if not keys:
+    return summaries
+  miss_texts = [texts[pending[key][0]] for key in keys]
+  for batch_idx, batch_summaries in iter_summary_batches(model, tokenizer, miss_texts, batch_size, **generate_kwargs):
+    for idx, pred_summary in zip(batch_idx, batch_summaries):
+      cache.put(keys[idx], pred_summary)
+      cache.index_text(keys[idx], miss_texts[idx], model_name, generate_kwargs)
+      for position in pending[keys[idx]]:
+        summaries[position] = pred_summary
+  return summaries
+
+def get_summary(text, model=None, tokenizer=None, cache=None, selector=None, **generate_kwargs):
+  return summarize_batch([text], batch_size=1, model=model, tokenizer=tokenizer, cache=cache, selector=selector,
+                         **generate_kwargs)[0]
+
+def last_written_row(output_path):
+  """
+  Row index of the last complete line in a summarize_file output, dropping a partially written tail
+  """
+  if not os.path.exists(output_path):
+    return -1
+  last_row, complete_size = -1, 0
+  with open(output_path, 'rb') as f:
+    for line in f:
+      if not line.endswith(b'\n'):
+        break
+      last_row = json.loads(line)['row']
+      complete_size += len(line)
+  if complete_size != os.path.getsize(output_path):
+    os.truncate(output_path, complete_size)
+  return last_row
+
+def summarize_file(input_path, output_path, text_column='long', keep_columns=(), clean=False,
+                   batch_size=8, prefetch_batches=4, model=None, tokenizer=None, cache=None, **generate_kwargs):
+  """
+  Stream articles from input_path through cleaning and batched summarization into a jsonl output_path,
+  resuming after the last row already written there
+  """
+  model, tokenizer = resolve_model(model, tokenizer)
+  start_row = last_written_row(output_path) + 1
+
+  def articles():
+    for row, record in read_articles(input_path):
+      if row < start_row or record.get(text_column) is None:
+        continue
+      text = str(record[text_column])
+      yield row, clean_text(text) if clean else text, {column: record.get(column) for column in keep_columns}
+
+  # the bounded queue is the backpressure: reading and cleaning stall once prefetch_batches batches are waiting
+  with open(output_path, 'a', encoding='utf-8') as f:
+    for batch in batched(prefetch(articles(), prefetch_batches * batch_size), batch_size):
+      summaries = summarize_batch([text for _, text, _ in batch], batch_size=batch_size,
+                                  model=model, tokenizer=tokenizer, cache=cache, **generate_kwargs)
+      for (row, _, columns), summary in zip(batch, summaries):
+        f.write(json.dumps({'row': row, **columns, 'summary': summary}) + '\n')
+      f.flush()
@@ -0,0 +1,165 @@
+"""
+Stage timers and counters for the summarization hot path, exported as Prometheus text or JSON,
+with opt-in cProfile and torch.profiler capture
+"""
+import collections
+import contextlib
+import json
+import threading
+import time
+
+NULL_STAGE = contextlib.nullcontext()
+
+class StageTimer:
+  __slots__ = ('owner', 'name', 'start', 'record_function')
+
+  def __init__(self, owner, name):
+    self.owner = owner
+    self.name = name
+    self.record_function = None
+
+  def __enter__(self):
+    if self.owner.torch_ranges:
+      # stages show up as named ranges in torch.profiler traces
+      from torch.profiler import record_function
+      self.record_function = record_function(self.name)
+      self.record_function.__enter__()
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, *exc_info):
+    self.owner.observe_stage(self.name, time.perf_counter() - self.start)
+    if self.record_function is not None:
+      self.record_function.__exit__(*exc_info)
+
+class Instrumentation:
+  """
+  Per-stage wall time, value summaries (count, sum, max) and counters; while disabled, stage() returns a shared
+  no-op context manager and count() and observe() return immediately
+  """
+  def __init__(self, enabled=False, prefix='text_summarizer'):
+    self.enabled = enabled
+    self.prefix = prefix
+    self.torch_ranges = False
+    self.lock = threading.Lock()
+    self.stages = collections.defaultdict(lambda: [0, 0.0, 0.0])   # stage -> [count, seconds, max seconds]
+    self.values = collections.defaultdict(lambda: [0, 0, 0])   # e.g. batch_size -> [count, sum, max]
+    self.counters = collections.Counter()
+
+  def enable(self):
+    self.enabled = True
+
+  def disable(self):
+    self.enabled = False
+
+  def stage(self, name):
+    if not self.enabled:
+      return NULL_STAGE
+    return StageTimer(self, name)
+
+  def observe_stage(self, name, seconds):
+    with self.lock:
+      stats = self.stages[name]
+      stats[0] += 1
+      stats[1] += seconds
+      stats[2] = max(stats[2], seconds)
+
+  def observe(self, name, value):
+    if not self.enabled:
+      return
+    with self.lock:
+      stats = self.values[name]
+      stats[0] += 1
+      stats[1] += value
+      stats[2] = max(stats[2], value)
+
+  def count(self, name, value=1):
+    if self.enabled:
+      with self.lock:
+        self.counters[name] += value
+
+  def reset(self):
+    with self.lock:
+      self.stages.clear()
+      self.values.clear()
+      self.counters.clear()
+
+  def snapshot(self):
+    with self.lock:
+      return {
+        'stages': {name: {'count': count, 'seconds': round(seconds, 6), 'mean_seconds': round(seconds / count, 6),
+                          'max_seconds': round(max_seconds, 6)}
+                   for name, (count, seconds, max_seconds) in sorted(self.stages.items())},
+        'values': {name: {'count': count, 'sum': total, 'mean': round(total / count, 3), 'max': maximum}
+                   for name, (count, total, maximum) in sorted(self.values.items())},
+        'counters': dict(sorted(self.counters.items())),
+      }
+
+  def to_json(self, path=None):
+    text = json.dumps(self.snapshot(), indent=2)
+    if path is not None:
+      with open(path, 'w') as f:
+        f.write(text)
+    return text
+
+  def to_prometheus(self):
+    """
+    Prometheus text exposition format: stage times as a summary labelled by stage, value summaries and counter totals
+    """
+    snapshot, prefix = self.snapshot(), self.prefix
+    lines = []
+    if snapshot['stages']:
+      lines += [f"# HELP {prefix}_stage_seconds Wall time spent per pipeline stage.", f"# TYPE {prefix}_stage_seconds summary"]
+      for name, stats in snapshot['stages'].items():
+        lines += [f'{prefix}_stage_seconds_sum{{stage="{name}"}} {stats["seconds"]}',
+                  f'{prefix}_stage_seconds_count{{stage="{name}"}} {stats["count"]}']
+      lines.append(f"# TYPE {prefix}_stage_seconds_max gauge")
+      lines += [f'{prefix}_stage_seconds_max{{stage="{name}"}} {stats["max_seconds"]}' for name, stats in snapshot['stages'].items()]
+    for name, stats in snapshot['values'].items():
+      lines += [f"# TYPE {prefix}_{name} summary", f"{prefix}_{name}_sum {stats['sum']}", f"{prefix}_{name}_count {stats['count']}",
+                f"# TYPE {prefix}_{name}_max gauge", f"{prefix}_{name}_max {stats['max']}"]
+    for name, value in snapshot['counters'].items():
+      lines += [f"# TYPE {prefix}_{name}_total counter", f"{prefix}_{name}_total {value}"]
+    return "\n".join(lines) + "\n"
+
+  @contextlib.contextmanager
+  def profile(self, output_path=None, mode='cprofile', sort_by=None, limit=30):
+    """
+    Instrument and profile the enclosed code with cProfile (stats file at output_path) or torch.profiler
+    (chrome trace at output_path, stages as named ranges), printing the top limit entries afterwards
+    """
+    if mode not in ('cprofile', 'torch'):
+      raise ValueError(f"unknown profiler: {mode}")
+    was_enabled = self.enabled
+    self.enabled = True
+    try:
+      if mode == 'cprofile':
+        import cProfile
+        import pstats
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+          yield profiler
+        finally:
+          profiler.disable()
+        if output_path is not None:
+          profiler.dump_stats(output_path)
+        pstats.Stats(profiler).sort_stats(sort_by or 'cumulative').print_stats(limit)
+      else:
+        import torch
+        from torch.profiler import ProfilerActivity, profile
+        activities = [ProfilerActivity.CPU] + ([ProfilerActivity.CUDA] if torch.cuda.is_available() else [])
+        self.torch_ranges = True
+        try:
+          with profile(activities=activities, record_shapes=True) as profiler:
+            yield profiler
+        finally:
+          self.torch_ranges = False
+        if output_path is not None:
+          profiler.export_chrome_trace(output_path)
+        print(profiler.key_averages().table(sort_by=sort_by or 'self_cpu_time_total', row_limit=limit))
+    finally:
+      self.enabled = was_enabled
+
+# named apart from this module, which `from .instrumentation import ...` binds as a package attribute
+stage_metrics = Instrumentation()
@@ -0,0 +1,95 @@
+"""
+Map-reduce summarization of articles longer than the model's input window
+"""
+from .inference import summarize_batch
+from .resources import resolve_model, split_sentences
+
+def split_long_sentence(sentence, num_tokens, max_tokens):
+  # sentences longer than a window are cut on word boundaries into roughly window-sized pieces
+  words = sentence.split()
+  num_pieces = -(-num_tokens // max_tokens)
+  piece_size = -(-len(words) // num_pieces)
+  return [" ".join(words[i:i + piece_size]) for i in range(0, len(words), piece_size)]
+
+def sentence_windows(text, tokenizer, window_tokens=None, overlap_tokens=64):
+  """
+  Split text into windows of whole sentences that fit window_tokens, each starting with the trailing
+  sentences of the previous window that fit in overlap_tokens, capped at half a window so windows keep advancing
+  """
+  window_tokens = window_tokens or tokenizer.model_max_length
+  budget = window_tokens - tokenizer.num_special_tokens_to_add()
+  overlap_tokens = min(overlap_tokens, budget // 2)
+  sentences = split_sentences(text)
+  if not sentences:
+    return []
+
+  pieces = []
+  lengths = [len(ids) for ids in tokenizer(sentences, add_special_tokens=False)['input_ids']]
+  for sentence, length in zip(sentences, lengths):
+    if length <= budget:
+      pieces.append((sentence, length))
+    else:
+      parts = split_long_sentence(sentence, length, budget)
+      part_lengths = [len(ids) for ids in tokenizer(parts, add_special_tokens=False)['input_ids']]
+      pieces.extend(zip(parts, part_lengths))
+
+  windows, current, current_tokens = [], [], 0
+  for sentence, length in pieces:
+    if current and current_tokens + length > budget:
+      windows.append(" ".join(sentence for sentence, _ in current))
+      # carry over trailing sentences so a fact split across the boundary is seen whole once
+      overlap, overlap_size = [], 0
+      for previous in reversed(current):
+        if overlap_size + previous[1] > min(overlap_tokens, budget - length):
+          break
+        overlap.insert(0, previous)
+        overlap_size += previous[1]
+      current, current_tokens = overlap, overlap_size
+    current.append((sentence, length))
+    current_tokens += length
+  windows.append(" ".join(sentence for sentence, _ in current))
+  return windows
+
+def summarize_long_batch(texts, model=None, tokenizer=None, window_tokens=None, overlap_tokens=64, max_windows=None,
+                         reduce=True, batch_size=8, cache=None, **generate_kwargs):
+  """
+  Summarize every sentence window of every text in one batched pass, then summarize the joined
+  partial summaries again while they still span more than one window
+  """
+  model, tokenizer = resolve_model(model, tokenizer)
+  summaries = [None] * len(texts)
+  pending = {idx: str(text) for idx, text in enumerate(texts)}
+
+  while pending:
+    windows, owners = [], []
+    window_counts = {}
+    for idx, text in pending.items():
+      text_windows = sentence_windows(text, tokenizer, window_tokens, overlap_tokens)[:max_windows]
+      window_counts[idx] = len(text_windows)
+      windows.extend(text_windows)
+      owners.extend([idx] * len(text_windows))
+
+    # micro-batching in summarize_batch bounds memory however many windows there are
+    partials = summarize_batch(windows, batch_size=batch_size, model=model, tokenizer=tokenizer, cache=cache, **generate_kwargs)
+    joined = {idx: [] for idx in pending}
+    for idx, partial in zip(owners, partials):
+      joined[idx].append(partial)
+
+    next_pending = {}
+    for idx, parts in joined.items():
+      summary = " ".join(parts)
+      # another round only while it can still shrink the text to fewer windows
+      if reduce and window_counts[idx] > 1:
+        next_pending[idx] = summary
+      else:
+        summaries[idx] = summary
+    if next_pending:
+      next_counts = {idx: len(sentence_windows(text, tokenizer, window_tokens, overlap_tokens)) for idx, text in next_pending.items()}
+      for idx in list(next_pending):
+        if next_counts[idx] > 1 and next_counts[idx] >= window_counts[idx]:
+          summaries[idx] = next_pending.pop(idx)
+    pending = next_pending
+  return summaries
+
+def summarize_long(text, model=None, tokenizer=None, **kwargs):
+  return summarize_long_batch([text], model=model, tokenizer=tokenizer, **kwargs)[0]
@@ -0,0 +1,231 @@
+"""
+ROUGE scoring
+"""
+import functools
+import itertools
+import re
+
+from collections import Counter
+
+import numpy as np
+
+from .instrumentation import stage_metrics
+from .resources import split_sentences
+
+ROUGE_KEYS = [f"{rouge_type}_{measure}" for rouge_type in ("rouge1", "rouge2", "rougeL") for measure in ("precision", "recall", "fmeasure")]
+# summary-level LCS over newline-separated sentences, scored only when a RougeScorer is built with rouge_lsum=True
+ROUGE_LSUM_KEYS = [f"rougeLsum_{measure}" for measure in ("precision", "recall", "fmeasure")]
+
+class RougeScorer:
+  """
+  rouge1, rouge2 and rougeL (and with rouge_lsum, rougeLsum) scores matching rouge_score,
+  with each prediction/reference pair tokenized once
+  """
+  non_alphanum = re.compile(r"[^a-z0-9]+")
+
+  def __init__(self, use_stemmer=False, rouge_lsum=False):
+    self.keys = ROUGE_KEYS + ROUGE_LSUM_KEYS if rouge_lsum else ROUGE_KEYS
+    self.stemmer = None
+    if use_stemmer:
+      from nltk.stem.porter import PorterStemmer
+      self.stemmer = PorterStemmer()
+    self.stems = {}
+    self.vocab = {}
+
+  def stem(self, token):
+    if token not in self.stems:
+      self.stems[token] = self.stemmer.stem(token)
+    return self.stems[token]
+
+  def tokenize(self, text):
+    # same normalization as rouge_score.tokenize, with tokens mapped to integer ids
+    tokens = self.non_alphanum.sub(" ", str(text).lower()).split()
+    if self.stemmer:
+      tokens = [self.stem(token) if len(token) > 3 else token for token in tokens]
+    return [self.vocab.setdefault(token, len(self.vocab)) for token in tokens]
+
+  @staticmethod
+  def ngram_counts(ids, n):
+    if n == 1:
+      return Counter(ids)
+    return Counter(first << 32 | second for first, second in zip(ids, ids[1:]))
+
+  @staticmethod
+  def lcs_length(a, b):
+    # bit-parallel LCS (Allison-Dix): one big-int update per token of b instead of a len(a) x len(b) table
+    if not a or not b:
+      return 0
+    masks = {}
+    for i, token in enumerate(a):
+      masks[token] = masks.get(token, 0) | (1 << i)
+    full = (1 << len(a)) - 1
+    row = full
+    for token in b:
+      matches = row & masks.get(token, 0)
+      row = ((row + matches) | (row - matches)) & full
+    return len(a) - bin(row).count("1")
+
+  @staticmethod
+  def lcs_indices(a, b):
+    """
+    Positions in a of one longest common subsequence of a and b, backtracked the way rouge_score does
+    """
+    table = [[0] * (len(b) + 1) for _ in range(len(a) + 1)]
+    for i, token in enumerate(a, 1):
+      row, above = table[i], table[i - 1]
+      for j, other in enumerate(b, 1):
+        row[j] = above[j - 1] + 1 if token == other else max(above[j], row[j - 1])
+    indices, i, j = [], len(a), len(b)
+    while i > 0 and j > 0:
+      if a[i - 1] == b[j - 1]:
+        indices.append(i - 1)
+        i, j = i - 1, j - 1
+      elif table[i][j - 1] > table[i - 1][j]:
+        j -= 1
+      else:
+        i -= 1
+    return indices[::-1]
+
+  def summary_lcs(self, prediction, reference):
+    """
+    rougeLsum (precision, recall, fmeasure): union LCS of each reference sentence against every predicted sentence
+    """
+    pred_sents = [self.tokenize(line) for line in str(prediction).split("\n") if line]
+    ref_sents = [self.tokenize(line) for line in str(reference).split("\n") if line]
+    pred_count, ref_count = sum(map(len, pred_sents)), sum(map(len, ref_sents))
+    if not pred_count or not ref_count:
+      return 0.0, 0.0, 0.0
+    pred_left, ref_left = Counter(itertools.chain(*pred_sents)), Counter(itertools.chain(*ref_sents))
+    hits = 0
+    for ref_ids in ref_sents:
+      union = sorted(set().union(*(self.lcs_indices(ref_ids, pred_ids) for pred_ids in pred_sents)))
+      for token in (ref_ids[i] for i in union):
+        # a token only counts as often as it occurs in both texts
+        if pred_left[token] > 0 and ref_left[token] > 0:
+          hits += 1
+          pred_left[token] -= 1
+          ref_left[token] -= 1
+    return self.precision_recall_f(hits, pred_count, ref_count)
+
+  @staticmethod
+  def precision_recall_f(overlap, pred_count, ref_count):
+    precision = overlap / max(pred_count, 1)
+    recall = overlap / max(ref_count, 1)
+    fmeasure = 2 * precision * recall / (precision + recall) if precision + recall > 0 else 0.0
+    return precision, recall, fmeasure
+
+  def score(self, predictions, references):
+    """
+    Per-pair scores as an array with one row per pair and columns in self.keys order
+    """
+    scores = np.zeros((len(predictions), len(self.keys)))
+    for i, (prediction, reference) in enumerate(zip(predictions, references)):
+      pred_ids, ref_ids = self.tokenize(prediction), self.tokenize(reference)
+      row = []
+      for n in (1, 2):
+        pred_ngrams, ref_ngrams = self.ngram_counts(pred_ids, n), self.ngram_counts(ref_ids, n)
+        overlap = sum((pred_ngrams & ref_ngrams).values())
+        row.extend(self.precision_recall_f(overlap, max(len(pred_ids) - n + 1, 0), max(len(ref_ids) - n + 1, 0)))
+      if pred_ids and ref_ids:
+        row.extend(self.precision_recall_f(self.lcs_length(ref_ids, pred_ids), len(pred_ids), len(ref_ids)))
+      else:
+        row.extend((0.0, 0.0, 0.0))
+      if len(self.keys) > len(ROUGE_KEYS):
+        row.extend(self.summary_lcs(prediction, reference))
+      scores[i] = row
+    return scores
+
+  @staticmethod
+  def bootstrap(scores, n_samples=1000, confidence=0.95, seed=0, chunk_size=100):
+    """
+    Percentile bootstrap of the mean scores, returning (low, mid, high) arrays like rouge_score's BootstrapAggregator
+    """
+    rng = np.random.default_rng(seed)
+    n = len(scores)
+    means = []
+    for start in range(0, n_samples, chunk_size):
+      # resampling with replacement is a multinomial draw of how often each row is picked
+      weights = rng.multinomial(n, np.full(n, 1 / n), size=min(chunk_size, n_samples - start))
+      means.append(weights @ scores / n)
+    means = np.concatenate(means)
+    alpha = (1 - confidence) / 2 * 100
+    return tuple(np.percentile(means, q, axis=0) for q in (alpha, 50, 100 - alpha))
+
+  def compute(self, predictions, references, n_bootstrap=0):
+    """
+    Corpus mean of every score, or (low, mid, high) per score when n_bootstrap > 0
+    """
+    scores = self.score(predictions, references)
+    if not n_bootstrap:
+      return dict(zip(self.keys, scores.mean(axis=0).tolist()))
+    low, mid, high = self.bootstrap(scores, n_samples=n_bootstrap)
+    return {key: (low[i], mid[i], high[i]) for i, key in enumerate(self.keys)}
+
+rouge_scorer = RougeScorer()
+
+def compute_metrics(pred_str, label_str):
+  # one tokenization and scoring pass for all three rouge types instead of one per type
+  with stage_metrics.stage('score'):
+    result = rouge_scorer.compute(pred_str, label_str)
+  return {key: round(value, 4) for key, value in result.items()}
+
+@functools.lru_cache(maxsize=None)
+def stemmed_rouge_scorer():
+  # the key set of the datasets rouge metric, scored as plain means without its bootstrap resampling
+  return RougeScorer(use_stemmer=True, rouge_lsum=True)
+
+def rouge_fmeasures(predictions, references):
+  """
+  rouge1, rouge2, rougeL and rougeLsum f-measures (x100) of newline sentence-split texts
+  """
+  result = stemmed_rouge_scorer().compute(predictions, references)
+  return {key[:-len('_fmeasure')]: value * 100 for key, value in result.items() if key.endswith('_fmeasure')}
+
+def sentence_lines(text):
+  return "\n".join(split_sentences(text))
+
+def compute_metrics_from_text(decoded_preds, decoded_labels, tokenizer):
+  # Rouge expects a newline after each sentence
+  with stage_metrics.stage('sentence_split'):
+    decoded_preds = [sentence_lines(pred) for pred in decoded_preds]
+    decoded_labels = [sentence_lines(label) for label in decoded_labels]
+
+  with stage_metrics.stage('score'):
+    result = rouge_fmeasures(decoded_preds, decoded_labels)
+
+  encoded_preds = tokenizer.encode(decoded_preds, skip_special_tokens=True)
+  # Add mean generated length
+  prediction_lens = [np.count_nonzero(pred != tokenizer.pad_token_id) for pred in encoded_preds]
+  result["gen_len"] = np.mean(prediction_lens)
+
+  return {k: round(v, 4) for k, v in result.items()}
+
+def logits_to_token_ids(logits, labels):
+  # the Trainer's preprocess_logits_for_metrics: keep the teacher-forced argmax tokens rather than vocab-sized logits
+  if isinstance(logits, tuple):
+    logits = logits[0]
+  return logits.argmax(dim=-1)
+
+def compute_metrics_from_tokens(eval_pred, tokenizer):
+  predictions, labels = eval_pred
+  with stage_metrics.stage('decode'):
+    # the Trainer pads predictions of different lengths with -100 when it gathers them
+    predictions = np.where(predictions != -100, predictions, tokenizer.pad_token_id)
+    decoded_preds = tokenizer.batch_decode(predictions, skip_special_tokens=True)
+    # Replace -100 in the labels as we can't decode them.
+    labels = np.where(labels != -100, labels, tokenizer.pad_token_id)
+    decoded_labels = tokenizer.batch_decode(labels, skip_special_tokens=True)
+
+  # Rouge expects a newline after each sentence
+  with stage_metrics.stage('sentence_split'):
+    decoded_preds = [sentence_lines(pred) for pred in decoded_preds]
+    decoded_labels = [sentence_lines(label) for label in decoded_labels]
+
+  with stage_metrics.stage('score'):
+    result = rouge_fmeasures(decoded_preds, decoded_labels)
+
+  # Add mean generated length
+  prediction_lens = [np.count_nonzero(pred != tokenizer.pad_token_id) for pred in predictions]
+  result["gen_len"] = np.mean(prediction_lens)
+
+  return {k: round(v, 4) for k, v in result.items()}
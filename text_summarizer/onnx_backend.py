@@ -0,0 +1,310 @@
+"""
+Pegasus exported to ONNX (encoder, first decoder step, decoder with past) and decoded on ONNX Runtime
+"""
+import json
+import os
+
+import numpy as np
+import torch
+
+ONNX_FILES = {'encoder': 'encoder.onnx', 'decoder': 'decoder.onnx', 'decoder_with_past': 'decoder_with_past.onnx'}
+
+class EncoderGraph(torch.nn.Module):
+  def __init__(self, model):
+    super().__init__()
+    self.model = model
+
+  def forward(self, input_ids, attention_mask):
+    return self.model.get_encoder()(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state
+
+class DecoderGraph(torch.nn.Module):
+  """
+  One decoder step returning logits and the present key/values: self and cross attention ones without past,
+  only the self attention ones when the past (self and cross, four tensors per layer) is passed in
+  """
+  def __init__(self, model):
+    super().__init__()
+    self.model = model
+    self.num_layers = model.config.decoder_layers
+
+  def forward(self, input_ids, encoder_hidden_states, encoder_attention_mask, *past):
+    from transformers.cache_utils import DynamicCache, EncoderDecoderCache
+    if past:
+      cache = EncoderDecoderCache(tuple(past[4 * layer:4 * layer + 4] for layer in range(self.num_layers)))
+    else:
+      cache = EncoderDecoderCache(DynamicCache(), DynamicCache())
+    outputs = self.model.model.decoder(input_ids=input_ids, encoder_hidden_states=encoder_hidden_states,
+                                       encoder_attention_mask=encoder_attention_mask, past_key_values=cache, use_cache=True)
+    logits = self.model.lm_head(outputs.last_hidden_state) + self.model.final_logits_bias
+    present = []
+    for layer in range(self.num_layers):
+      self_attention = outputs.past_key_values.self_attention_cache.layers[layer]
+      present += [self_attention.keys, self_attention.values]
+      if not past:
+        cross_attention = outputs.past_key_values.cross_attention_cache.layers[layer]
+        present += [cross_attention.keys, cross_attention.values]
+    return (logits, *present)
+
+def past_names(num_layers, prefix, cross=True):
+  names = []
+  for layer in range(num_layers):
+    names += [f'{prefix}.{layer}.decoder.key', f'{prefix}.{layer}.decoder.value']
+    if cross:
+      names += [f'{prefix}.{layer}.encoder.key', f'{prefix}.{layer}.encoder.value']
+  return names
+
+def export_onnx(model, tokenizer, output_dir, opset_version=17):
+  """
+  Write the three ONNX graphs with the tokenizer, config and generation config, everything needed to summarize offline
+  """
+  os.makedirs(output_dir, exist_ok=True)
+  model = model.to('cpu').eval()
+  tokenizer.save_pretrained(output_dir)
+  model.config.save_pretrained(output_dir)
+  model.generation_config.save_pretrained(output_dir)
+  num_layers = model.config.decoder_layers
+
+  sample = tokenizer(["An example article to trace the graphs with.", "Another one."], padding=True, return_tensors='pt')
+  start_ids = torch.full((2, 1), model.config.decoder_start_token_id, dtype=torch.long)
+  # the wrappers start in training mode and export switches the wrapped model to their mode, so both go to eval
+  encoder, decoder = EncoderGraph(model).eval(), DecoderGraph(model).eval()
+  with torch.no_grad():
+    hidden_states = encoder(sample['input_ids'], sample['attention_mask'])
+    first_step = decoder(start_ids, hidden_states, sample['attention_mask'])
+
+  batch = {0: 'batch'}
+  io_axes = {
+    'input_ids': {0: 'batch', 1: 'sequence'},
+    'attention_mask': {0: 'batch', 1: 'sequence'},
+    'encoder_hidden_states': {0: 'batch', 1: 'encoder_sequence'},
+    'encoder_attention_mask': {0: 'batch', 1: 'encoder_sequence'},
+    'last_hidden_state': {0: 'batch', 1: 'sequence'},
+    'logits': {0: 'batch', 1: 'sequence'},
+  }
+  def axes(names, past_axis):
+    return {name: {**batch, 2: past_axis if '.decoder.' in name else 'encoder_sequence'} for name in names}
+
+  torch.onnx.export(encoder, (sample['input_ids'], sample['attention_mask']), os.path.join(output_dir, ONNX_FILES['encoder']),
+                    input_names=['input_ids', 'attention_mask'], output_names=['last_hidden_state'],
+                    dynamic_axes={name: io_axes[name] for name in ('input_ids', 'attention_mask', 'last_hidden_state')},
+                    opset_version=opset_version, dynamo=False)
+
+  decoder_inputs = ['input_ids', 'encoder_hidden_states', 'encoder_attention_mask']
+  present = past_names(num_layers, 'present')
+  torch.onnx.export(decoder, (start_ids, hidden_states, sample['attention_mask']), os.path.join(output_dir, ONNX_FILES['decoder']),
+                    input_names=decoder_inputs, output_names=['logits'] + present,
+                    dynamic_axes={**{name: io_axes[name] for name in decoder_inputs + ['logits']}, **axes(present, 'past_sequence')},
+                    opset_version=opset_version, dynamo=False)
+
+  past = past_names(num_layers, 'past_key_values')
+  present_self = past_names(num_layers, 'present', cross=False)
+  next_ids = torch.full((2, 1), model.config.eos_token_id, dtype=torch.long)
+  torch.onnx.export(decoder, (next_ids, hidden_states, sample['attention_mask'], *first_step[1:]),
+                    os.path.join(output_dir, ONNX_FILES['decoder_with_past']),
+                    input_names=decoder_inputs + past, output_names=['logits'] + present_self,
+                    dynamic_axes={**{name: io_axes[name] for name in decoder_inputs + ['logits']},
+                                  **axes(past, 'past_sequence'), **axes(present_self, 'present_sequence')},
+                    opset_version=opset_version, dynamo=False)
+  return output_dir
+
+def log_softmax(logits):
+  shifted = logits - logits.max(axis=-1, keepdims=True)
+  return shifted - np.log(np.exp(shifted).sum(axis=-1, keepdims=True))
+
+def top_k(scores, k):
+  # descending like torch.topk, the stable sort keeps the lower index first on ties
+  indices = np.argsort(-scores, axis=-1, kind='stable')[:, :k]
+  return np.take_along_axis(scores, indices, axis=-1), indices
+
+class OnnxSummarizer:
+  """
+  Drop-in for PegasusForConditionalGeneration in get_summary and summarize_batch, running greedy or beam search
+  (the transformers algorithm, ported to numpy) on ONNX Runtime sessions
+  """
+  device = torch.device('cpu')
+  supported_kwargs = {'num_beams', 'max_length', 'max_new_tokens', 'min_length', 'length_penalty', 'early_stopping'}
+
+  def __init__(self, model_dir, providers=('CPUExecutionProvider',), intra_op_threads=None):
+    import onnxruntime
+
+    options = onnxruntime.SessionOptions()
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if intra_op_threads:
+      options.intra_op_num_threads = intra_op_threads
+    self.sessions = {name: onnxruntime.InferenceSession(os.path.join(model_dir, filename), options, providers=list(providers))
+                     for name, filename in ONNX_FILES.items()}
+    self.input_names = {name: {node.name for node in session.get_inputs()} for name, session in self.sessions.items()}
+
+    with open(os.path.join(model_dir, 'config.json')) as f:
+      config = json.load(f)
+    generation_path = os.path.join(model_dir, 'generation_config.json')
+    generation = {}
+    if os.path.exists(generation_path):
+      with open(generation_path) as f:
+        generation = json.load(f)
+    self.name_or_path = model_dir
+    self.num_layers = config['decoder_layers']
+    self.decoder_start_token_id = generation.get('decoder_start_token_id', config['decoder_start_token_id'])
+    self.eos_token_id = generation.get('eos_token_id', config['eos_token_id'])
+    self.pad_token_id = generation.get('pad_token_id', config['pad_token_id'])
+    self.forced_eos_token_id = generation.get('forced_eos_token_id', config.get('forced_eos_token_id'))
+    self.defaults = {
+      'num_beams': generation.get('num_beams', 1),
+      'max_length': generation.get('max_length', 20),
+      'min_length': generation.get('min_length', 0),
+      'length_penalty': generation.get('length_penalty', 1.0),
+      'early_stopping': generation.get('early_stopping', False),
+    }
+
+  def run(self, name, feed):
+    names = self.input_names[name]
+    return self.sessions[name].run(None, {key: value for key, value in feed.items() if key in names})
+
+  def process(self, scores, cur_len, max_length, min_length):
+    # the logits processors transformers adds for these settings: min length and forced eos on the last step
+    if cur_len < min_length:
+      scores[:, self.eos_token_id] = -np.inf
+    if self.forced_eos_token_id is not None and cur_len == max_length - 1:
+      scores[:] = -np.inf
+      scores[:, self.forced_eos_token_id] = 0
+    return scores
+
+  def decoder_step(self, input_ids, hidden_states, attention_mask, past):
+    feed = {'input_ids': input_ids, 'encoder_hidden_states': hidden_states, 'encoder_attention_mask': attention_mask}
+    if past is None:
+      outputs = self.run('decoder', feed)
+      return outputs[0][:, -1], list(outputs[1:])
+    feed.update(zip(past_names(self.num_layers, 'past_key_values'), past))
+    outputs = self.run('decoder_with_past', feed)
+    for layer in range(self.num_layers):
+      past[4 * layer], past[4 * layer + 1] = outputs[1 + 2 * layer], outputs[2 + 2 * layer]
+    return outputs[0][:, -1], past
+
+  def generate(self, input_ids=None, attention_mask=None, **generate_kwargs):
+    unsupported = set(generate_kwargs) - self.supported_kwargs
+    if unsupported:
+      raise ValueError(f"unsupported generation settings for the ONNX backend: {sorted(unsupported)}")
+    settings = {**self.defaults, **{key: value for key, value in generate_kwargs.items() if value is not None}}
+    if 'max_new_tokens' in settings:
+      settings['max_length'] = 1 + settings.pop('max_new_tokens')
+
+    input_ids = np.asarray(input_ids, dtype=np.int64)
+    attention_mask = np.ones_like(input_ids) if attention_mask is None else np.asarray(attention_mask, dtype=np.int64)
+    hidden_states = self.run('encoder', {'input_ids': input_ids, 'attention_mask': attention_mask})[0]
+    if settings['num_beams'] > 1:
+      sequences = self.beam_search(hidden_states, attention_mask, settings)
+    else:
+      sequences = self.greedy_search(hidden_states, attention_mask, settings)
+    return torch.from_numpy(sequences)
+
+  def greedy_search(self, hidden_states, attention_mask, settings):
+    batch_size, max_length = len(hidden_states), settings['max_length']
+    sequences = np.full((batch_size, 1), self.decoder_start_token_id, dtype=np.int64)
+    unfinished = np.ones(batch_size, dtype=bool)
+    past = None
+    while True:
+      logits, past = self.decoder_step(sequences[:, -1:], hidden_states, attention_mask, past)
+      scores = self.process(logits.astype(np.float32), sequences.shape[1], max_length, settings['min_length'])
+      next_ids = np.where(unfinished, scores.argmax(axis=-1), self.pad_token_id)
+      sequences = np.concatenate([sequences, next_ids[:, None]], axis=1)
+      unfinished &= next_ids != self.eos_token_id
+      if not unfinished.any() or sequences.shape[1] >= max_length:
+        return sequences
+
+  def beam_search(self, hidden_states, attention_mask, settings):
+    num_beams, max_length = settings['num_beams'], settings['max_length']
+    length_penalty, early_stopping = settings['length_penalty'], settings['early_stopping']
+    batch_size, prompt_len, cur_len = len(hidden_states), 1, 1
+    beams_to_keep = 2 * num_beams
+    top_num_beam_mask = np.arange(beams_to_keep) < num_beams
+    # transformers fills unused positions with the pad token, or eos when the pad token id is 0
+    fill_value = self.pad_token_id or self.eos_token_id
+
+    hidden_states = np.repeat(hidden_states, num_beams, axis=0)
+    attention_mask = np.repeat(attention_mask, num_beams, axis=0)
+    running_sequences = np.full((batch_size, num_beams, max_length), fill_value, dtype=np.int64)
+    running_sequences[:, :, 0] = self.decoder_start_token_id
+    sequences = running_sequences.copy()
+    lengths = np.zeros((batch_size, num_beams), dtype=np.int64)   # generated tokens of each finished hypothesis
+    running_scores = np.zeros((batch_size, num_beams), dtype=np.float32)
+    running_scores[:, 1:] = -1e9
+    beam_scores = np.full((batch_size, num_beams), -1e9, dtype=np.float32)
+    is_sent_finished = np.zeros((batch_size, num_beams), dtype=bool)
+    can_improve = np.ones((batch_size, 1), dtype=bool)
+    batch_offset = np.arange(batch_size)[:, None] * num_beams
+    past = None
+
+    while True:
+      input_ids = running_sequences[:, :, cur_len - 1].reshape(-1, 1)
+      logits, past = self.decoder_step(input_ids, hidden_states, attention_mask, past)
+      log_probs = self.process(log_softmax(logits.astype(np.float32)), cur_len, max_length, settings['min_length'])
+      vocab_size = log_probs.shape[-1]
+      log_probs = (log_probs.reshape(batch_size, num_beams, vocab_size) + running_scores[:, :, None]).reshape(batch_size, -1)
+
+      # top 2 * num_beams continuations over all beams, so num_beams stay open even if the best ones end
+      topk_scores, topk_indices = top_k(log_probs, beams_to_keep)
+      topk_beams, topk_ids = topk_indices // vocab_size, topk_indices % vocab_size
+      topk_sequences = np.take_along_axis(running_sequences, topk_beams[:, :, None], axis=1)
+      topk_sequences[:, :, cur_len] = topk_ids
+      hits_stop = (topk_ids == self.eos_token_id) | (cur_len + 1 >= max_length)
+
+      next_scores, next_indices = top_k(topk_scores + hits_stop * np.float32(-1e9), num_beams)
+      running_sequences = np.take_along_axis(topk_sequences, next_indices[:, :, None], axis=1)
+      running_scores = next_scores
+      source_beams = np.take_along_axis(topk_beams, next_indices, axis=1)
+
+      finished_scores = topk_scores / ((cur_len + 1 - prompt_len) ** length_penalty)
+      batch_full = is_sent_finished.all(axis=-1, keepdims=True) & (early_stopping is True)
+      just_finished = hits_stop & top_num_beam_mask[None, :]
+      finished_scores = finished_scores + (batch_full | ~can_improve | ~just_finished) * np.float32(-1e9)
+      merged_scores = np.concatenate([beam_scores, finished_scores], axis=1)
+      merged_sequences = np.concatenate([sequences, topk_sequences], axis=1)
+      merged_lengths = np.concatenate([lengths, np.full_like(finished_scores, cur_len + 1 - prompt_len, dtype=np.int64)], axis=1)
+      merged_finished = np.concatenate([is_sent_finished, just_finished], axis=1)
+      beam_scores, keep = top_k(merged_scores, num_beams)
+      sequences = np.take_along_axis(merged_sequences, keep[:, :, None], axis=1)
+      lengths = np.take_along_axis(merged_lengths, keep, axis=1)
+      is_sent_finished = np.take_along_axis(merged_finished, keep, axis=1)
+
+      # only self attention rows follow their beam, cross attention rows are equal within a batch item
+      beam_idx = (source_beams + batch_offset).reshape(-1)
+      for layer in range(self.num_layers):
+        past[4 * layer], past[4 * layer + 1] = past[4 * layer][beam_idx], past[4 * layer + 1][beam_idx]
+
+      cur_len += 1
+      if early_stopping == "never" and length_penalty > 0.0:
+        best_length = max_length - prompt_len
+      else:
+        best_length = cur_len - prompt_len
+      best_running = running_scores[:, :1] / (best_length ** length_penalty)
+      worst_finished = np.where(is_sent_finished, beam_scores.min(axis=1, keepdims=True), -1e9)
+      can_improve = can_improve & (best_running > worst_finished).any(axis=-1, keepdims=True)
+      done = is_sent_finished.all() & (early_stopping is True)
+      if not can_improve.any() or done or hits_stop.all():
+        break
+
+    return sequences[:, 0, :prompt_len + int(lengths[:, 0].max())]
+
+def load_onnx_model(model_dir, intra_op_threads=None):
+  """
+  (tokenizer, OnnxSummarizer) from a directory written by export_onnx, without network access
+  """
+  from transformers import AutoTokenizer
+  return AutoTokenizer.from_pretrained(model_dir, local_files_only=True), OnnxSummarizer(model_dir, intra_op_threads=intra_op_threads)
+
+def onnx_parity(model, onnx_model, tokenizer, texts, batch_size=8, **generate_kwargs):
+  """
+  Share of texts whose ONNX Runtime summary is token for token the PyTorch one, with the differing texts
+  """
+  from .inference import iter_summary_batches
+
+  outputs = {}
+  for name, candidate in (('torch', model), ('onnx', onnx_model)):
+    outputs[name] = [None] * len(texts)
+    for batch_idx, batch_summaries in iter_summary_batches(candidate, tokenizer, texts, batch_size, **generate_kwargs):
+      for idx, summary in zip(batch_idx, batch_summaries):
+        outputs[name][idx] = summary
+  mismatches = [(text, expected, got) for text, expected, got in zip(texts, outputs['torch'], outputs['onnx']) if expected != got]
+  report = {'texts': len(texts), 'exact_match': 1 - len(mismatches) / max(len(texts), 1), 'mismatches': mismatches}
+  print(f"onnx parity: {report['exact_match']:.1%} of {len(texts)} summaries identical")
+  return report
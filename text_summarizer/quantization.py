@@ -0,0 +1,83 @@
+"""
+CPU inference with dynamically int8-quantized Linear layers
+"""
+import io
+import json
+import os
+
+import torch
+
+from .resources import DEFAULT_MODEL_NAME
+
+def configure_threads(intra_op_threads=None, inter_op_threads=None):
+  """
+  Set torch's intra-op and inter-op thread pools, returning the sizes in effect
+  """
+  if intra_op_threads:
+    torch.set_num_threads(intra_op_threads)
+  if inter_op_threads:
+    try:
+      torch.set_num_interop_threads(inter_op_threads)
+    except RuntimeError:
+      pass   # fixed once any inter-op parallel work has run in this process
+  return {'intra_op_threads': torch.get_num_threads(), 'inter_op_threads': torch.get_num_interop_threads()}
+
+def quantize_model(model):
+  """
+  Copy of model with every nn.Linear replaced by a dynamically quantized int8 Linear, model itself is moved to the cpu
+  """
+  from torch.ao.quantization import quantize_dynamic
+  return quantize_dynamic(model.to('cpu').eval(), {torch.nn.Linear}, dtype=torch.qint8)
+
+def model_size_bytes(model):
+  # serialized size counts packed int8 weights, which parameters() does not list
+  buffer = io.BytesIO()
+  torch.save(model.state_dict(), buffer)
+  return buffer.tell()
+
+def versions():
+  from transformers import __version__ as transformers_version
+  return {'torch': torch.__version__, 'transformers': transformers_version}
+
+def save_quantized(model, tokenizer, output_dir):
+  os.makedirs(output_dir, exist_ok=True)
+  tokenizer.save_pretrained(output_dir)
+  tmp_path = os.path.join(output_dir, 'quantized_model.pt.tmp')
+  # the whole module is pickled, quantized modules cannot be rebuilt from a plain state dict without quantizing again
+  torch.save(model, tmp_path)
+  os.replace(tmp_path, os.path.join(output_dir, 'quantized_model.pt'))
+  with open(os.path.join(output_dir, 'quantized_versions.json'), 'w') as f:
+    json.dump(versions(), f)
+
+def load_quantized(output_dir):
+  """
+  (tokenizer, model) saved by save_quantized, or None when missing or saved by other torch/transformers versions
+  """
+  model_path = os.path.join(output_dir, 'quantized_model.pt')
+  versions_path = os.path.join(output_dir, 'quantized_versions.json')
+  if not (os.path.exists(model_path) and os.path.exists(versions_path)):
+    return None
+  with open(versions_path) as f:
+    if json.load(f) != versions():
+      return None
+  from transformers import AutoTokenizer
+  tokenizer = AutoTokenizer.from_pretrained(output_dir)
+  model = torch.load(model_path, weights_only=False)
+  return tokenizer, model.eval()
+
+def load_cpu_model(model_name=DEFAULT_MODEL_NAME, quantized_dir=None, intra_op_threads=None, inter_op_threads=None):
+  """
+  Quantized (tokenizer, model) for cpu serving, reusing the copy in quantized_dir instead of quantizing at every start
+  """
+  configure_threads(intra_op_threads, inter_op_threads)
+  if quantized_dir is not None:
+    loaded = load_quantized(quantized_dir)
+    if loaded is not None:
+      return loaded
+
+  from transformers import PegasusForConditionalGeneration, PegasusTokenizer
+  tokenizer = PegasusTokenizer.from_pretrained(model_name)
+  model = quantize_model(PegasusForConditionalGeneration.from_pretrained(model_name))
+  if quantized_dir is not None:
+    save_quantized(model, tokenizer, quantized_dir)
+  return tokenizer, model
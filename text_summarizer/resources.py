@@ -0,0 +1,52 @@
+"""
+Lazily loaded NLTK data and models, so importing the package stays cheap
+"""
+import functools
+
+DEFAULT_MODEL_NAME = 'google/pegasus-xsum'
+
+def torch_device():
+  import torch
+  return 'cuda' if torch.cuda.is_available() else 'cpu'
+
+def ensure_nltk_data(package, path):
+  """
+  Download an NLTK package the first time it is needed instead of on every start
+  """
+  import nltk
+  try:
+    nltk.data.find(path)
+  except LookupError:
+    nltk.download(package, quiet=True)
+
+@functools.lru_cache(maxsize=None)
+def english_stopwords():
+  ensure_nltk_data('stopwords', 'corpora/stopwords')
+  from nltk.corpus import stopwords
+  return frozenset(stopwords.words('english'))
+
+def split_sentences(text):
+  # nltk 3.9 and later load sent_tokenize's model from punkt_tab instead of the pickled punkt
+  ensure_nltk_data('punkt_tab', 'tokenizers/punkt_tab')
+  import nltk
+  return nltk.sent_tokenize(str(text).strip())
+
+@functools.lru_cache(maxsize=None)
+def load_model(model_name=DEFAULT_MODEL_NAME):
+  """
+  Load a Pegasus tokenizer and model once per model name or directory
+  """
+  from transformers import PegasusForConditionalGeneration, PegasusTokenizer
+  tokenizer = PegasusTokenizer.from_pretrained(model_name)
+  model = PegasusForConditionalGeneration.from_pretrained(model_name).to(torch_device())
+  return tokenizer, model
+
+def resolve_model(model=None, tokenizer=None):
+  """
+  Fill in whichever of model and tokenizer is missing with the default Pegasus model
+  """
+  if model is None or tokenizer is None:
+    default_tokenizer, default_model = load_model()
+    model = default_model if model is None else model
+    tokenizer = default_tokenizer if tokenizer is None else tokenizer
+  return model, tokenizer
@@ -0,0 +1,229 @@
+"""
+Asyncio summarization service batching concurrent requests into one generate call,
+load-tested with python -m text_summarizer.service
+"""
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import itertools
+import json
+import time
+
+import numpy as np
+
+from .data import read_articles
+from .inference import summarize_batch
+from .resources import DEFAULT_MODEL_NAME, load_model, resolve_model
+from .summary_cache import SummaryCache, setting_value
+
+Request = collections.namedtuple('Request', ['text', 'settings', 'generate_kwargs', 'future', 'enqueued'])
+
+class SummarizationService:
+  """
+  Queue of summarization requests, gathered for up to max_latency seconds or max_batch_size requests
+  and generated as one batch in a single worker thread, so concurrent callers share a forward pass
+  instead of competing for the cpu threads
+  """
+  def __init__(self, model=None, tokenizer=None, max_batch_size=8, max_latency=0.02, timeout=None, max_queue_size=0,
+               cache=None, selector=None, **generate_kwargs):
+    self.model, self.tokenizer = resolve_model(model, tokenizer)
+    self.max_batch_size = max_batch_size
+    self.max_latency = max_latency
+    self.timeout = timeout
+    self.max_queue_size = max_queue_size
+    self.cache = cache
+    self.selector = selector
+    self.generate_kwargs = generate_kwargs
+    self.queue = None
+    self.batcher = None
+    self.executor = None
+    self.in_flight = []   # requests of the batch being generated, answered by stop() if it cancels them
+    self.counters = collections.Counter()
+    self.batch_sizes = collections.Counter()
+    self.latencies = collections.deque(maxlen=10000)   # seconds from enqueue to result, most recent requests
+    self.max_queue_depth = 0
+
+  async def start(self):
+    if self.batcher is None:
+      # one worker: batches run one after another, each using all of torch's intra-op threads
+      self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='summarize')
+      self.queue = asyncio.Queue(self.max_queue_size)
+      self.batcher = asyncio.create_task(self.run_batches())
+    return self
+
+  async def stop(self):
+    if self.batcher is not None:
+      self.batcher.cancel()
+      try:
+        await self.batcher
+      except asyncio.CancelledError:
+        pass
+      self.batcher = None
+      # the batch in the worker thread can no longer be delivered, so its callers are released along with the queued ones
+      for request in self.in_flight:
+        request.future.cancel()
+      self.in_flight = []
+      while not self.queue.empty():
+        self.queue.get_nowait().future.cancel()
+      # waited for off the event loop, the running generate call cannot be interrupted
+      await asyncio.get_running_loop().run_in_executor(None, self.executor.shutdown)
+      self.executor = None
+
+  async def __aenter__(self):
+    return await self.start()
+
+  async def __aexit__(self, *exc_info):
+    await self.stop()
+
+  async def summarize(self, text, timeout=None, **generate_kwargs):
+    """
+    Summary of text, raising asyncio.TimeoutError when it is not ready within timeout seconds of the call,
+    including any wait for room in a full queue
+    """
+    await self.start()
+    loop = asyncio.get_running_loop()
+    timeout = self.timeout if timeout is None else timeout
+    deadline = None if timeout is None else loop.time() + timeout
+    generate_kwargs = {**self.generate_kwargs, **generate_kwargs}
+    settings = json.dumps(sorted(generate_kwargs.items()), default=setting_value)
+    future = loop.create_future()
+    queue = self.queue
+    try:
+      await asyncio.wait_for(queue.put(Request(str(text), settings, generate_kwargs, future, time.perf_counter())), timeout)
+      if queue is not self.queue or self.batcher is None:
+        future.cancel()   # the service stopped while this call waited for room, nothing reads that queue anymore
+      self.counters['requests'] += 1
+      self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+      # a timed out request is cancelled, and skipped if its batch has not started yet
+      return await asyncio.wait_for(future, None if deadline is None else max(deadline - loop.time(), 0))
+    except asyncio.TimeoutError:
+      self.counters['timeouts'] += 1
+      raise
+
+  async def next_batch(self):
+    """
+    First waiting request and whatever else arrives within max_latency of it, up to max_batch_size requests
+    """
+    batch = [await self.queue.get()]
+    deadline = batch[0].enqueued + self.max_latency
+    while len(batch) < self.max_batch_size:
+      try:
+        batch.append(self.queue.get_nowait())
+        continue
+      except asyncio.QueueEmpty:
+        pass
+      remaining = deadline - time.perf_counter()
+      if remaining <= 0:
+        break
+      try:
+        batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+      except asyncio.TimeoutError:
+        break
+    return batch
+
+  async def run_batches(self):
+    loop = asyncio.get_running_loop()
+    while True:
+      batch = [request for request in await self.next_batch() if not request.future.done()]
+      self.in_flight = batch
+      # requests only share a generate call when their generation settings match
+      groups = collections.defaultdict(list)
+      for request in batch:
+        groups[request.settings].append(request)
+
+      for requests in groups.values():
+        texts = [request.text for request in requests]
+        self.counters['batches'] += 1
+        self.batch_sizes[len(requests)] += 1
+        try:
+          summaries = await loop.run_in_executor(self.executor, lambda: summarize_batch(
+            texts, batch_size=len(texts), model=self.model, tokenizer=self.tokenizer, cache=self.cache,
+            selector=self.selector, **requests[0].generate_kwargs))
+        except Exception as e:
+          self.counters['errors'] += len(requests)
+          for request in requests:
+            if not request.future.done():
+              request.future.set_exception(e)
+          continue
+
+        finished = time.perf_counter()
+        for request, summary in zip(requests, summaries):
+          if not request.future.done():
+            request.future.set_result(summary)
+            self.latencies.append(finished - request.enqueued)
+            self.counters['completed'] += 1
+      self.in_flight = []
+
+  def metrics(self):
+    """
+    Request and batch counters, queue depth and latency percentiles of the recent requests
+    """
+    metrics = {name: self.counters[name] for name in ('requests', 'completed', 'timeouts', 'errors', 'batches')}
+    metrics['queue_depth'] = self.queue.qsize() if self.queue is not None else 0
+    metrics['max_queue_depth'] = self.max_queue_depth
+    batched = sum(size * count for size, count in self.batch_sizes.items())
+    metrics['mean_batch_size'] = round(batched / metrics['batches'], 3) if metrics['batches'] else 0.0
+    metrics['batch_sizes'] = dict(sorted(self.batch_sizes.items()))
+    if self.latencies:
+      for q in (50, 95, 99):
+        metrics[f'latency_p{q}'] = round(float(np.percentile(self.latencies, q)), 4)
+    return metrics
+
+async def load_test(service, texts, num_requests=None, concurrency=16, timeout=None):
+  """
+  Keep concurrency callers sending texts to service until num_requests are answered or timed out
+  """
+  num_requests = num_requests or len(texts)
+  next_text = iter(itertools.islice(itertools.cycle(texts), num_requests))
+  timeouts = 0
+
+  async def caller():
+    nonlocal timeouts
+    for text in next_text:
+      try:
+        await service.summarize(text, timeout=timeout)
+      except asyncio.TimeoutError:
+        timeouts += 1
+
+  start = time.perf_counter()
+  await asyncio.gather(*(caller() for _ in range(concurrency)))
+  seconds = time.perf_counter() - start
+  report = {'requests': num_requests, 'concurrency': concurrency, 'seconds': round(seconds, 3),
+            'requests_per_sec': round(num_requests / seconds, 3), 'timeouts': timeouts, 'service': service.metrics()}
+  return report
+
+def load_test_cli(argv=None):
+  """
+  Command line entry driving a local model through SummarizationService with concurrent callers
+  """
+  parser = argparse.ArgumentParser(description="Load test the micro-batching summarization service")
+  parser.add_argument('data', help="csv, jsonl or xlsx file with a text column")
+  parser.add_argument('--model', default=DEFAULT_MODEL_NAME, help="model name or local directory")
+  parser.add_argument('--text-column', default='long')
+  parser.add_argument('--texts', type=int, default=200, help="distinct texts read from the dataset")
+  parser.add_argument('--requests', type=int, default=None, help="requests to send, cycling over the texts")
+  parser.add_argument('--concurrency', type=int, default=16)
+  parser.add_argument('--max-batch-size', type=int, default=8, help="1 compares against unbatched serving")
+  parser.add_argument('--max-latency', type=float, default=0.02, help="seconds to wait for a batch to fill")
+  parser.add_argument('--timeout', type=float, default=None, help="per-request timeout in seconds")
+  parser.add_argument('--num-beams', type=int, default=None)
+  parser.add_argument('--cache', action='store_true', help="answer repeated texts from an in-memory SummaryCache")
+  args = parser.parse_args(argv)
+
+  texts = [record[args.text_column] for _, record in itertools.islice(read_articles(args.data), args.texts)
+           if record.get(args.text_column) is not None]
+  tokenizer, model = load_model(args.model)
+  generate_kwargs = {'num_beams': args.num_beams} if args.num_beams else {}
+
+  async def run():
+    async with SummarizationService(model, tokenizer, max_batch_size=args.max_batch_size, max_latency=args.max_latency,
+                                    cache=SummaryCache() if args.cache else None, **generate_kwargs) as service:
+      return await load_test(service, texts, args.requests, args.concurrency, args.timeout)
+
+  report = asyncio.run(run())
+  print(json.dumps(report, indent=2))
+  return report
+
+if __name__ == '__main__':
+  load_test_cli()
@@ -0,0 +1,103 @@
+"""
+Columnar dataset snapshot, built once from the news xlsx and memory-mapped by later runs
+"""
+import argparse
+import json
+import os
+import re
+
+import pandas as pd
+import pyarrow as pa
+
+from .resources import DEFAULT_MODEL_NAME
+
+NEWS_DATA_URL = 'https://github.com/ruhan-islam/text-summarizer/blob/main/dataset/news_data.xlsx?raw=true'
+
+# html entities left in the scraped text, decoded in the same order the notebook applied them
+ENTITY_REPLACEMENTS = {'&#34;': '\'', '&#39;': '\'', '&amp;': '&'}
+ENTITY_PATTERN = re.compile("|".join(re.escape(entity) for entity in ENTITY_REPLACEMENTS))
+
+def read_table(source):
+  """
+  Read a local or remote xlsx, csv, jsonl or parquet file into a DataFrame
+  """
+  ext = os.path.splitext(source.split('?')[0])[1].lower()
+  if ext == '.xlsx':
+    return pd.read_excel(source)
+  if ext == '.csv':
+    return pd.read_csv(source)
+  if ext in ('.jsonl', '.json'):
+    return pd.read_json(source, lines=True)
+  if ext == '.parquet':
+    return pd.read_parquet(source)
+  raise ValueError(f"unsupported input format: {source}")
+
+def decode_entities(series):
+  # one regex scan per column instead of one str.replace per entity
+  return series.str.replace(ENTITY_PATTERN, lambda match: ENTITY_REPLACEMENTS[match.group(0)], regex=True)
+
+def token_counts(tokenizer, texts, chunk_size=1000):
+  counts = []
+  for start in range(0, len(texts), chunk_size):
+    encodings = tokenizer(texts[start:start + chunk_size], truncation=False)
+    counts.extend(len(ids) for ids in encodings['input_ids'])
+  return counts
+
+def build_snapshot(source, snapshot_path, columns=('short', 'long'), model_name=DEFAULT_MODEL_NAME, tokenizer=None,
+                   batch_rows=10000):
+  """
+  Decode entities, drop incomplete rows and write the text columns with word and token counts
+  as an uncompressed Arrow IPC file that later runs can memory-map
+  """
+  df = read_table(source)[list(columns)]
+  for col in columns:
+    df[col] = decode_entities(df[col])
+  df = df.dropna().reset_index(drop=True)
+
+  if tokenizer is None:
+    from transformers import PegasusTokenizer
+    tokenizer = PegasusTokenizer.from_pretrained(model_name)
+  for col in columns:
+    df[col + "_num_words"] = df[col].str.count(r"\S+").astype('int32')
+    df[col + "_num_tokens"] = pd.Series(token_counts(tokenizer, df[col].tolist()), dtype='int32')
+
+  table = pa.Table.from_pandas(df, preserve_index=False)
+  metadata = {'source': source, 'tokenizer': tokenizer.name_or_path, 'columns': list(columns)}
+  table = table.replace_schema_metadata({**(table.schema.metadata or {}), b'text_summarizer': json.dumps(metadata)})
+
+  tmp_path = snapshot_path + '.tmp'
+  with pa.OSFile(tmp_path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+    writer.write_table(table, max_chunksize=batch_rows)
+  os.replace(tmp_path, snapshot_path)   # a half-written snapshot is never picked up by load_snapshot
+  return snapshot_path
+
+def load_snapshot(snapshot_path):
+  """
+  Memory-map a snapshot, column buffers are paged in only when a slice of them is read
+  """
+  return pa.ipc.open_file(pa.memory_map(snapshot_path, 'r')).read_all()
+
+def ensure_snapshot(source=NEWS_DATA_URL, snapshot_path='news_data.arrow', **build_kwargs):
+  if not os.path.exists(snapshot_path):
+    build_snapshot(source, snapshot_path, **build_kwargs)
+  return load_snapshot(snapshot_path)
+
+def snapshot_split(snapshot, start, size, text_column='long', label_column='short'):
+  """
+  Texts and labels of rows start to start + size, converting only that slice to python strings
+  """
+  split = snapshot.slice(start, size)
+  return split.column(text_column).to_pylist(), split.column(label_column).to_pylist()
+
+def snapshot_cli(argv=None):
+  parser = argparse.ArgumentParser(description="Build a memory-mappable snapshot of the news dataset")
+  parser.add_argument('output', help="arrow file to write")
+  parser.add_argument('--source', default=NEWS_DATA_URL, help="xlsx, csv, jsonl or parquet file or url")
+  parser.add_argument('--model', default=DEFAULT_MODEL_NAME, help="tokenizer used for the token counts")
+  args = parser.parse_args(argv)
+  build_snapshot(args.source, args.output, model_name=args.model)
+  snapshot = load_snapshot(args.output)
+  print(f"{args.output}: {snapshot.num_rows} rows, columns {snapshot.column_names}")
+
+if __name__ == '__main__':
+  snapshot_cli()
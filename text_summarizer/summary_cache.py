@@ -0,0 +1,231 @@
+"""
+Two-tier cache of generated summaries, keyed by normalized text, model and generation parameters
+"""
+import collections
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+import weakref
+
+# model -> (parameters, weights_signature, fingerprint), the weights are sampled again only once they change;
+# the parameter list is kept too, walking the module tree for it takes milliseconds on pegasus-large
+# (so modules swapped in place, rather than in a copy as quantize_model makes, go unnoticed)
+fingerprints = weakref.WeakKeyDictionary()
+
+def weights_signature(params):
+  # in-place updates bump a tensor's version counter, reassigned or moved weights change its data pointer
+  try:
+    return tuple((param.data_ptr(), param._version) for param in params)
+  except RuntimeError:
+    return None   # inference tensors keep no version counter
+
+def weights_fingerprint(model, num_tensors=8, num_values=4096):
+  """
+  Short hash of the dtype, the quantized layers and strided samples of a few parameters spread over the model,
+  or None for models that are not torch modules
+  """
+  if not hasattr(model, 'parameters') or not hasattr(model, 'modules'):
+    return None
+  cached = fingerprints.get(model)
+  if cached is not None:
+    params, signature, fingerprint = cached
+    if signature == weights_signature(params):
+      return fingerprint
+  params = list(model.parameters())
+  signature = weights_signature(params)
+  quantized = any('quantized' in type(module).__module__ for module in model.modules())
+  digest = hashlib.blake2b(f"{params[0].dtype if params else None} {quantized}".encode('utf-8'), digest_size=8)
+  # the last parameters are the decoder's top, which fine-tuning trains even with the lower layers frozen
+  for idx in sorted({round(i * (len(params) - 1) / max(num_tensors - 1, 1)) for i in range(num_tensors)} if params else ()):
+    values = params[idx].detach().flatten()
+    values = values[::max(1, len(values) // num_values)][:num_values]
+    digest.update(values.float().cpu().numpy().tobytes())
+  fingerprint = digest.hexdigest()
+  if signature is not None:
+    fingerprints[model] = (params, signature, fingerprint)
+  return fingerprint
+
+def model_id(model):
+  """
+  Name or directory the model was loaded from plus a fingerprint of its weights, so summaries of different
+  checkpoints never collide, nor those of a model fine-tuned in place or quantized and the checkpoint it came from
+  """
+  config = getattr(model, 'config', None)
+  name = getattr(model, 'name_or_path', None) or getattr(config, '_name_or_path', None) or type(model).__name__
+  fingerprint = weights_fingerprint(model)
+  return name if fingerprint is None else f"{name}@{fingerprint}"
+
+def setting_value(value):
+  # models passed as generate kwargs, like a draft model, are keyed by checkpoint instead of their repr
+  return model_id(value) if hasattr(value, 'config') else str(value)
+
+class SummaryCache:
+  """
+  In-memory LRU of summaries in front of an optional sqlite file, both bounded by size and an optional ttl in seconds
+  """
+  whitespace = re.compile(r"\s+")
+
+  def __init__(self, max_entries=10000, ttl=None, cache_dir=None, max_disk_bytes=1 << 30, near_duplicate_threshold=None):
+    self.max_entries = max_entries
+    self.ttl = ttl
+    self.max_disk_bytes = max_disk_bytes
+    # generation settings -> NearDuplicateIndex of the texts summarized with them
+    self.near_duplicate_threshold = near_duplicate_threshold
+    self.near_duplicate_indexes = {}
+    self.memory = collections.OrderedDict()   # key -> (summary, created), oldest access first
+    self.lock = threading.Lock()
+    self.counters = collections.Counter()
+
+    self.db = None
+    if cache_dir is not None:
+      os.makedirs(cache_dir, exist_ok=True)
+      self.db = sqlite3.connect(os.path.join(cache_dir, 'summaries.sqlite'), check_same_thread=False)
+      self.db.execute("CREATE TABLE IF NOT EXISTS summaries "
+                      "(key TEXT PRIMARY KEY, summary TEXT, created REAL, accessed REAL, size INTEGER)")
+      self.db.execute("CREATE INDEX IF NOT EXISTS summaries_accessed ON summaries (accessed)")
+      self.db.commit()
+
+  @staticmethod
+  def settings(model_name, generate_kwargs):
+    return json.dumps([model_name, sorted(generate_kwargs.items())], default=setting_value)
+
+  def key(self, text, model_name, generate_kwargs):
+    # reposted articles differ in unicode forms and whitespace far more often than in words
+    text = self.whitespace.sub(" ", unicodedata.normalize('NFKC', str(text))).strip()
+    settings = self.settings(model_name, generate_kwargs)
+    return hashlib.blake2b((settings + "\0" + text).encode('utf-8'), digest_size=16).hexdigest()
+
+  def expired(self, created, now):
+    return self.ttl is not None and now - created > self.ttl
+
+  def get(self, key):
+    """
+    Cached summary for key or None, promoting disk hits into memory
+    """
+    with self.lock:
+      summary, tier = self.find(key)
+      self.counters[tier] += 1
+      return summary
+
+  def find(self, key):
+    """
+    (summary, counter name) for key, dropping it from both tiers once it is older than the ttl
+    """
+    now = time.time()
+    entry = self.memory.get(key)
+    if entry is not None:
+      if not self.expired(entry[1], now):
+        self.memory.move_to_end(key)
+        return entry[0], 'memory_hits'
+      del self.memory[key]
+      self.counters['expired'] += 1
+
+    if self.db is not None:
+      row = self.db.execute("SELECT summary, created FROM summaries WHERE key = ?", (key,)).fetchone()
+      if row is not None and not self.expired(row[1], now):
+        self.db.execute("UPDATE summaries SET accessed = ? WHERE key = ?", (now, key))
+        self.db.commit()
+        self.remember(key, row[0], row[1])
+        return row[0], 'disk_hits'
+      if row is not None:
+        self.db.execute("DELETE FROM summaries WHERE key = ?", (key,))
+        self.db.commit()
+        self.counters['expired'] += 1
+    return None, 'misses'
+
+  def get_near_duplicate(self, text, model_name, generate_kwargs):
+    """
+    Cached summary of an indexed near-duplicate of text under the same settings, or None
+    """
+    index = self.near_duplicate_indexes.get(self.settings(model_name, generate_kwargs))
+    if index is None:
+      return None
+    signature = index.hasher.signature(text)   # hashed outside the lock, it is the slow part
+    with self.lock:
+      for key, _ in index.query(signature=signature):
+        summary, tier = self.find(key)
+        if summary is not None:
+          self.counters['near_duplicate_hits'] += 1
+          return summary
+    return None
+
+  def index_text(self, key, text, model_name, generate_kwargs):
+    """
+    Make the summary stored under key reusable for near-duplicates of text, when near_duplicate_threshold is set
+    """
+    if self.near_duplicate_threshold is None:
+      return
+    from .dedup import NearDuplicateIndex
+    settings = self.settings(model_name, generate_kwargs)
+    with self.lock:
+      if settings not in self.near_duplicate_indexes:
+        self.near_duplicate_indexes[settings] = NearDuplicateIndex(self.near_duplicate_threshold)
+      index = self.near_duplicate_indexes[settings]
+    signature = index.hasher.signature(text)
+    with self.lock:
+      index.add(None, ids=[key], signatures=signature[None, :])
+
+  def remember(self, key, summary, created):
+    self.memory[key] = (summary, created)
+    self.memory.move_to_end(key)
+    while len(self.memory) > self.max_entries:
+      self.memory.popitem(last=False)
+      self.counters['memory_evictions'] += 1
+
+  def put(self, key, summary):
+    now = time.time()
+    with self.lock:
+      self.remember(key, summary, now)
+      if self.db is not None:
+        self.db.execute("INSERT OR REPLACE INTO summaries VALUES (?, ?, ?, ?, ?)",
+                        (key, summary, now, now, len(summary.encode('utf-8'))))
+        self.evict_disk(now)
+        self.db.commit()
+
+  def evict_disk(self, now):
+    if self.ttl is not None:
+      self.counters['disk_evictions'] += self.db.execute("DELETE FROM summaries WHERE created < ?", (now - self.ttl,)).rowcount
+    total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM summaries").fetchone()[0]
+    if total <= self.max_disk_bytes:
+      return
+    # drop least recently used rows until the stored summaries fit the budget again
+    keys = []
+    for key, size in self.db.execute("SELECT key, size FROM summaries ORDER BY accessed"):
+      if total <= self.max_disk_bytes:
+        break
+      keys.append((key,))
+      total -= size
+    self.db.executemany("DELETE FROM summaries WHERE key = ?", keys)
+    self.counters['disk_evictions'] += len(keys)
+
+  def stats(self):
+    with self.lock:
+      stats = {name: self.counters[name] for name in ('memory_hits', 'disk_hits', 'near_duplicate_hits', 'misses',
+                                                       'expired', 'memory_evictions', 'disk_evictions')}
+      stats['memory_entries'] = len(self.memory)
+      if self.db is not None:
+        stats['disk_entries'] = self.db.execute("SELECT COUNT(*) FROM summaries").fetchone()[0]
+    # near-duplicate hits are lookups that missed exactly, so they are already part of the misses
+    lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+    hits = stats['memory_hits'] + stats['disk_hits'] + stats['near_duplicate_hits']
+    stats['hit_rate'] = hits / lookups if lookups else 0.0
+    return stats
+
+  def clear(self):
+    with self.lock:
+      self.memory.clear()
+      self.near_duplicate_indexes.clear()
+      self.counters.clear()
+      if self.db is not None:
+        self.db.execute("DELETE FROM summaries")
+        self.db.commit()
+
+  def close(self):
+    if self.db is not None:
+      self.db.close()
+      self.db = None
@@ -0,0 +1,206 @@
+"""
+Fine-tuning configuration
+"""
+import functools
+import os
+
+import torch
+
+from transformers import PegasusForConditionalGeneration, Trainer, TrainingArguments
+from transformers.trainer_pt_utils import LengthGroupedSampler
+
+from .data import PegasusDataCollator
+from .metrics import compute_metrics_from_tokens, logits_to_token_ids
+from .training_eval import EvalSubset, SubsetEvalCallback
+
+# memory-budget presets, most frugal first, all reaching an effective batch size of 16 through gradient accumulation
+TRAINING_PRESETS = {
+  'low_memory': {'per_device_train_batch_size': 1, 'effective_batch_size': 16, 'gradient_checkpointing': True,
+                 'freeze_embeddings': True, 'freeze_layers': 12, 'bf16': True},
+  'balanced': {'per_device_train_batch_size': 2, 'effective_batch_size': 16, 'gradient_checkpointing': True,
+               'freeze_embeddings': True, 'freeze_layers': 8, 'bf16': True},
+  'full': {'per_device_train_batch_size': 4, 'effective_batch_size': 16, 'gradient_checkpointing': True,
+           'freeze_embeddings': False, 'freeze_layers': 0, 'bf16': False},
+  'fast': {'per_device_train_batch_size': 8, 'effective_batch_size': 16, 'gradient_checkpointing': False,
+           'freeze_embeddings': False, 'freeze_layers': 0, 'bf16': False},
+}
+
+# transformers 5 replaced the group_by_length flag with a train_sampling_strategy
+if 'group_by_length' in TrainingArguments.__dataclass_fields__:
+  GROUP_BY_LENGTH_ARGS = {'group_by_length': True}
+else:
+  GROUP_BY_LENGTH_ARGS = {'train_sampling_strategy': 'group_by_length'}
+
+class PegasusTrainer(Trainer):
+  """
+  Trainer whose length-grouped sampler takes the lengths a PegasusDataset already keeps, instead of reading every row to measure them
+  """
+  def _get_train_sampler(self, train_dataset=None):
+    dataset = self.train_dataset if train_dataset is None else train_dataset
+    grouped = getattr(self.args, 'group_by_length', False) or getattr(self.args, 'train_sampling_strategy', None) == 'group_by_length'
+    if grouped and hasattr(dataset, 'lengths') and self.args.world_size <= 1:
+      return LengthGroupedSampler(self.args.train_batch_size * self.args.gradient_accumulation_steps, lengths=dataset.lengths.tolist())
+    # older transformers take no dataset argument
+    return super()._get_train_sampler() if train_dataset is None else super()._get_train_sampler(train_dataset)
+
+def frozen_modules(model, freeze_embeddings, freeze_layers):
+  # the output projection is tied to the shared embedding, so freezing it also freezes lm_head
+  modules = [model.model.shared] if freeze_embeddings else []
+  return modules + list(model.model.encoder.layers[:freeze_layers]) + list(model.model.decoder.layers[:freeze_layers])
+
+def estimate_training_memory_gb(model, preset, input_tokens=512, label_tokens=64):
+  """
+  Rough training footprint of a preset: fp32 weights, gradients and Adam moments of the trainable parameters, and
+  activations, kept per layer without gradient checkpointing and only at layer boundaries with it
+  """
+  config = model.config
+  num_params = sum(param.numel() for param in model.parameters())
+  frozen = {id(param) for module in frozen_modules(model, preset['freeze_embeddings'], preset['freeze_layers'])
+            for param in module.parameters()}
+  trainable = sum(param.numel() for param in model.parameters() if id(param) not in frozen)
+
+  tokens = preset['per_device_train_batch_size'] * (input_tokens * config.encoder_layers + label_tokens * config.decoder_layers)
+  attention = preset['per_device_train_batch_size'] * config.encoder_attention_heads * (
+    input_tokens ** 2 * config.encoder_layers + (label_tokens ** 2 + label_tokens * input_tokens) * config.decoder_layers)
+  # about 16 hidden-sized tensors per token and layer (attention, ffn intermediates, norms) plus the attention scores
+  activations = tokens * config.d_model * 16 + attention * 2
+  if preset['gradient_checkpointing']:
+    activations /= (config.encoder_layers + config.decoder_layers) / 2
+  bytes_per_value = 2 if preset['bf16'] else 4
+  total = num_params * 4 + trainable * (4 + 8) + activations * bytes_per_value
+  return total / 2 ** 30
+
+def select_preset(model, memory_budget_gb, input_tokens=512, label_tokens=64):
+  """
+  Name of the least restrictive preset whose estimated footprint fits memory_budget_gb
+  """
+  fitting = [name for name, preset in TRAINING_PRESETS.items()
+             if estimate_training_memory_gb(model, preset, input_tokens, label_tokens) <= memory_budget_gb]
+  if not fitting:
+    needed = estimate_training_memory_gb(model, TRAINING_PRESETS['low_memory'], input_tokens, label_tokens)
+    raise ValueError(f"no training preset fits {memory_budget_gb}GB, the smallest needs about {needed:.1f}GB")
+  return fitting[-1]
+
+def apply_preset(model, preset):
+  """
+  Enable gradient checkpointing and freeze the layers a preset asks for, returning its TrainingArguments settings
+  """
+  if preset['gradient_checkpointing']:
+    model.config.use_cache = False
+    try:
+      # non-reentrant checkpointing still computes gradients when the layers below it are frozen
+      model.gradient_checkpointing_enable(gradient_checkpointing_kwargs={'use_reentrant': False})
+    except TypeError:
+      model.gradient_checkpointing_enable()
+      model.enable_input_require_grads()
+  for module in frozen_modules(model, preset['freeze_embeddings'], preset['freeze_layers']):
+    for param in module.parameters():
+      param.requires_grad = False
+
+  # autocast to bfloat16 on the cpu, or on gpus that support it (not the T4)
+  bf16 = preset['bf16'] and (not torch.cuda.is_available() or torch.cuda.is_bf16_supported())
+  batch_size = preset['per_device_train_batch_size']
+  training_args = {
+    'per_device_train_batch_size': batch_size,
+    'gradient_accumulation_steps': max(1, -(-preset['effective_batch_size'] // batch_size)),
+    'bf16': bf16,
+  }
+  if bf16 and not torch.cuda.is_available():
+    # bf16 without a gpu has to be asked for explicitly, older transformers call the flag no_cuda
+    training_args['use_cpu' if 'use_cpu' in TrainingArguments.__dataclass_fields__ else 'no_cuda'] = True
+  return training_args
+
+def prepare_fine_tuning(model_name, tokenizer, train_dataset, model = None, val_dataset=None, freeze_encoder=False, num_epochs = 1, output_dir='./results', group_by_length=True, num_workers=0,
+                        preset=None, memory_budget_gb=None, eval_subset_size=None, eval_batch_size=16, async_eval=False,
+                        eval_generate_kwargs=None):
+  """
+  Prepare configurations and base model for fine-tuning, with a TRAINING_PRESETS name or dict as preset,
+  or the preset chosen for memory_budget_gb; with eval_subset_size, validation generates summaries for a
+  stratified subset of val_dataset instead of running the Trainer's evaluation over all of it
+  """
+  torch_device = 'cuda' if torch.cuda.is_available() else 'cpu'
+  if model == None:
+    model = PegasusForConditionalGeneration.from_pretrained(model_name).to(torch_device)
+  else:
+    model = model.to(torch_device)
+
+  if freeze_encoder:
+    for param in model.model.encoder.parameters():
+      param.requires_grad = False
+
+  if preset is None and memory_budget_gb is not None:
+    preset = select_preset(model, memory_budget_gb)
+  preset_args = {}
+  if preset is not None:
+    preset_args = apply_preset(model, TRAINING_PRESETS[preset] if isinstance(preset, str) else preset)
+  train_batch_size = preset_args.pop('per_device_train_batch_size', None)
+
+  data_collator = PegasusDataCollator(tokenizer)
+  compute_metrics = functools.partial(compute_metrics_from_tokens, tokenizer=tokenizer)
+
+  if val_dataset is not None:
+    training_args = TrainingArguments(
+      output_dir=output_dir,           # output directory
+      # num_train_epochs=2000,           # total number of training epochs
+      num_train_epochs=num_epochs,           # total number of training epochs
+      # per_device_train_batch_size=1,   # batch size per device during training, can increase if memory allows
+      per_device_train_batch_size=train_batch_size or 10,   # batch size per device during training, can increase if memory allows
+      # per_device_eval_batch_size=1,    # batch size for evaluation, can increase if memory allows
+      per_device_eval_batch_size=1,    # batch size for evaluation, can increase if memory allows
+      save_steps=250,                  # number of updates steps before checkpoint saves
+      save_total_limit=5,              # limit the total amount of checkpoints and deletes the older checkpoints
+      eval_strategy='steps' if eval_subset_size is None else 'no',   # evaluation strategy to adopt during training
+      eval_steps=50,                  # number of update steps before evaluation
+      warmup_steps=50,                # number of warmup steps for learning rate scheduler
+      weight_decay=0.01,               # strength of weight decay
+      logging_steps=50,
+      **(GROUP_BY_LENGTH_ARGS if group_by_length else {}),   # batch similar-length rows together to cut padding
+      dataloader_num_workers=num_workers,
+      **preset_args,                   # gradient accumulation and bf16 of the memory preset
+    )
+
+    trainer = PegasusTrainer(
+      model=model,                         # the instantiated 🤗 Transformers model to be trained
+      args=training_args,                  # training arguments, defined above
+      train_dataset=train_dataset,         # training dataset
+      eval_dataset=val_dataset,            # evaluation dataset
+      data_collator=data_collator,
+      processing_class=tokenizer,
+      compute_metrics=compute_metrics,
+      preprocess_logits_for_metrics=logits_to_token_ids,
+    )
+
+    if eval_subset_size is not None:
+      # references are decoded and sentence-split once here instead of at every evaluation
+      subset = EvalSubset.from_dataset(val_dataset, tokenizer, size=eval_subset_size)
+      trainer.add_callback(SubsetEvalCallback(subset, tokenizer, eval_steps=training_args.eval_steps, batch_size=eval_batch_size,
+                                              async_eval=async_eval, output_path=os.path.join(output_dir, 'subset_eval.jsonl'),
+                                              generate_kwargs=eval_generate_kwargs))
+
+  else:
+    training_args = TrainingArguments(
+      output_dir=output_dir,           # output directory
+      # num_train_epochs=2000,           # total number of training epochs
+      num_train_epochs=num_epochs,           # total number of training epochs
+      # per_device_train_batch_size=1,   # batch size per device during training, can increase if memory allows
+      per_device_train_batch_size=train_batch_size or 1,   # batch size per device during training, can increase if memory allows
+      save_steps=250,                  # number of updates steps before checkpoint saves
+      save_total_limit=5,              # limit the total amount of checkpoints and deletes the older checkpoints
+      warmup_steps=50,                # number of warmup steps for learning rate scheduler
+      weight_decay=0.01,               # strength of weight decay
+      logging_steps=50,
+      **(GROUP_BY_LENGTH_ARGS if group_by_length else {}),   # batch similar-length rows together to cut padding
+      dataloader_num_workers=num_workers,
+      **preset_args,                   # gradient accumulation and bf16 of the memory preset
+    )
+
+    trainer = PegasusTrainer(
+      model=model,                         # the instantiated 🤗 Transformers model to be trained
+      args=training_args,                  # training arguments, defined above
+      train_dataset=train_dataset,         # training dataset
+      data_collator=data_collator,
+      processing_class=tokenizer,
+      compute_metrics=compute_metrics
+    )
+
+  return trainer
@@ -0,0 +1,175 @@
+"""
+Generation-based evaluation during fine-tuning on a fixed stratified validation subset, with references decoded
+and sentence-split once, run in the training process or asynchronously on saved checkpoints
+"""
+import concurrent.futures
+import json
+import logging
+import multiprocessing
+import os
+import time
+
+import numpy as np
+import torch
+
+from transformers import TrainerCallback
+
+from .metrics import rouge_fmeasures, sentence_lines
+
+logger = logging.getLogger(__name__)
+
+def stratified_indices(lengths, size, num_strata=5, seed=0):
+  """
+  Sorted indices of a size-row sample drawn from each input length quantile in proportion to its rows
+  """
+  lengths = np.asarray(lengths)
+  if size >= len(lengths):
+    return np.arange(len(lengths))
+  rng = np.random.default_rng(seed)
+  edges = np.quantile(lengths, np.linspace(0, 1, num_strata + 1)[1:-1])
+  strata = np.searchsorted(edges, lengths, side='right')
+  counts = np.bincount(strata, minlength=num_strata)
+  # largest remainder allocation, so the strata add up to exactly size rows
+  quotas = size * counts / len(lengths)
+  takes = np.floor(quotas).astype(np.int64)
+  takes[np.argsort(takes - quotas, kind='stable')[:size - takes.sum()]] += 1
+  chosen = [rng.choice(np.flatnonzero(strata == stratum), take, replace=False)
+            for stratum, take in enumerate(np.minimum(takes, counts)) if take]
+  return np.sort(np.concatenate(chosen))
+
+class EvalSubset:
+  """
+  Input ids and sentence-split references of a stratified sample of a PegasusDataset, prepared once for every evaluation
+  """
+  def __init__(self, input_ids, reference_lines):
+    self.input_ids = input_ids
+    self.reference_lines = reference_lines
+
+  @classmethod
+  def from_dataset(cls, dataset, tokenizer, size=500, num_strata=5, seed=0):
+    lengths = dataset.lengths if hasattr(dataset, 'lengths') else [len(dataset[idx]['input_ids']) for idx in range(len(dataset))]
+    indices = stratified_indices(lengths, size, num_strata, seed)
+    items = [dataset[int(idx)] for idx in indices]
+    references = tokenizer.batch_decode([np.asarray(item['labels']) for item in items], skip_special_tokens=True)
+    # Rouge expects a newline after each sentence
+    return cls([np.asarray(item['input_ids']).tolist() for item in items], [sentence_lines(reference) for reference in references])
+
+  def __len__(self):
+    return len(self.input_ids)
+
+def generate_summaries(model, tokenizer, input_ids, batch_size=16, **generate_kwargs):
+  """
+  Decoded summaries of already tokenized inputs, generated in padded batches of similar length
+  """
+  order = sorted(range(len(input_ids)), key=lambda idx: len(input_ids[idx]), reverse=True)
+  summaries, generated_tokens = [None] * len(input_ids), 0
+  for start in range(0, len(order), batch_size):
+    batch_idx = order[start:start + batch_size]
+    tokens = tokenizer.pad({'input_ids': [input_ids[idx] for idx in batch_idx]}, return_tensors="pt").to(model.device)
+    with torch.inference_mode():
+      summary = model.generate(**tokens, **generate_kwargs)
+    generated_tokens += int((summary != tokenizer.pad_token_id).sum())
+    for idx, pred_summary in zip(batch_idx, tokenizer.batch_decode(summary, skip_special_tokens=True)):
+      summaries[idx] = pred_summary
+  return summaries, generated_tokens
+
+def evaluate_subset(model, tokenizer, subset, batch_size=16, **generate_kwargs):
+  """
+  eval_ prefixed ROUGE f-measures (x100) and mean generated length on subset, as compute_metrics_from_tokens reports them
+  """
+  start = time.perf_counter()
+  was_training = model.training
+  model.eval()
+  try:
+    predictions, generated_tokens = generate_summaries(model, tokenizer, subset.input_ids, batch_size, **generate_kwargs)
+  finally:
+    model.train(was_training)
+  predictions = [sentence_lines(prediction) for prediction in predictions]
+  metrics = {f'eval_{key}': round(value, 4) for key, value in rouge_fmeasures(predictions, subset.reference_lines).items()}
+  metrics['eval_gen_len'] = round(generated_tokens / max(len(subset), 1), 4)
+  metrics['eval_samples'] = len(subset)
+  metrics['eval_seconds'] = round(time.perf_counter() - start, 3)
+  return metrics
+
+def evaluate_checkpoint(checkpoint_dir, subset, batch_size=16, device='cpu', num_threads=None, generate_kwargs=None):
+  """
+  evaluate_subset on a saved checkpoint, meant for a separate process so training is not blocked
+  """
+  from transformers import AutoTokenizer, PegasusForConditionalGeneration
+
+  if num_threads:
+    torch.set_num_threads(num_threads)
+  tokenizer = AutoTokenizer.from_pretrained(checkpoint_dir)
+  model = PegasusForConditionalGeneration.from_pretrained(checkpoint_dir).to(device)
+  metrics = evaluate_subset(model, tokenizer, subset, batch_size, **(generate_kwargs or {}))
+  metrics['checkpoint'] = checkpoint_dir
+  return metrics
+
+class SubsetEvalCallback(TrainerCallback):
+  """
+  Evaluate the live model on subset every eval_steps, or with async_eval every saved checkpoint in a worker process
+  (one at a time, skipping to the latest checkpoint when several were saved meanwhile); results are added to the
+  trainer's log history and appended to output_path as json lines
+  """
+  def __init__(self, subset, tokenizer, eval_steps=50, batch_size=16, async_eval=False, device='cpu', num_threads=None,
+               output_path=None, generate_kwargs=None):
+    self.subset = subset
+    self.tokenizer = tokenizer
+    self.eval_steps = eval_steps
+    self.batch_size = batch_size
+    self.async_eval = async_eval
+    self.device = device
+    self.num_threads = num_threads
+    self.output_path = output_path
+    self.generate_kwargs = generate_kwargs or {}
+    self.executor = None
+    self.running = None   # (step, future) of the checkpoint being evaluated
+    self.pending = None   # (step, checkpoint_dir) of the newest checkpoint waiting for the worker
+    self.results = []
+
+  def record(self, state, step, metrics):
+    metrics = {**metrics, 'step': step}
+    self.results.append(metrics)
+    state.log_history.append(metrics)
+    logger.info("subset eval: %s", metrics)
+    if self.output_path is not None:
+      with open(self.output_path, 'a') as f:
+        f.write(json.dumps(metrics) + "\n")
+
+  def submit(self, step, checkpoint_dir):
+    if self.executor is None:
+      # spawned, a forked child would inherit torch's thread pools mid-training
+      self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'))
+    self.running = (step, self.executor.submit(evaluate_checkpoint, checkpoint_dir, self.subset, self.batch_size, self.device,
+                                               self.num_threads, self.generate_kwargs))
+
+  def collect(self, state, wait=False):
+    if self.running is not None and (wait or self.running[1].done()):
+      step, future = self.running
+      self.running = None
+      self.record(state, step, future.result())
+    if self.running is None and self.pending is not None:
+      self.submit(*self.pending)
+      self.pending = None
+
+  def on_step_end(self, args, state, control, model=None, **kwargs):
+    if self.async_eval:
+      self.collect(state)
+    elif self.eval_steps and state.global_step % self.eval_steps == 0:
+      self.record(state, state.global_step, evaluate_subset(model, self.tokenizer, self.subset, self.batch_size, **self.generate_kwargs))
+    return control
+
+  def on_save(self, args, state, control, **kwargs):
+    if self.async_eval:
+      self.pending = (state.global_step, os.path.join(args.output_dir, f'checkpoint-{state.global_step}'))
+      self.collect(state)
+    return control
+
+  def on_train_end(self, args, state, control, **kwargs):
+    if self.async_eval:
+      while self.running is not None:
+        self.collect(state, wait=True)
+      if self.executor is not None:
+        self.executor.shutdown()
+        self.executor = None
+    return control